@@ -0,0 +1,130 @@
+"""Дисковый кэш эмбеддингов для SimpleRAG"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Хранилище эмбеддингов в SQLite
+    
+    Векторы хранятся в float16: вдвое меньше места на диске, а точности
+    достаточно для поиска похожих чанков
+    """
+    
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._connection.commit()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Эмбеддинги, найденные в кэше: ключ -> вектор"""
+        found = {}
+        with self._lock:
+            # SQLite ограничивает число параметров запроса, поэтому ищем порциями
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float16).astype(np.float32).tolist()
+        return found
+    
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Сохранение эмбеддингов в кэш"""
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float16).tobytes())
+                    for key, vector in items.items()
+                ]
+            )
+            self._connection.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка над моделью эмбеддингов с дисковым кэшем
+    
+    В API эмбеддингов уходят только тексты, которых еще нет в кэше, поэтому
+    повторная загрузка той же статьи и повторные вопросы не тратят запросы
+    """
+    
+    def __init__(self, embeddings, model_name: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+    
+    def _key(self, text: str) -> str:
+        """Ключ кэша: SHA-256 от имени модели и текста"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+    
+    def _split_cached(self, texts: List[str]):
+        """Ключи текстов, найденные в кэше векторы и тексты без эмбеддингов"""
+        keys = [self._key(text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in cached))
+        return keys, cached, missing
+    
+    def _merge(self, keys: List[str], cached: Dict[str, List[float]],
+               missing: List[str], vectors: List[List[float]]) -> List[List[float]]:
+        """Сохранение новых эмбеддингов и сборка результата в исходном порядке"""
+        if missing:
+            new_vectors = {self._key(text): vector for text, vector in zip(missing, vectors)}
+            self.cache.put_many(new_vectors)
+            cached.update(new_vectors)
+            logger.info(f"Эмбеддинги: {len(missing)} новых, {len(set(keys)) - len(missing)} из кэша")
+        return [cached[key] for key in keys]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги документов: из кэша или через модель"""
+        keys, cached, missing = self._split_cached(texts)
+        vectors = self.embeddings.embed_documents(missing) if missing else []
+        return self._merge(keys, cached, missing, vectors)
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Асинхронная версия embed_documents
+        
+        Чтение и запись SQLite идут в отдельном потоке: медленный диск или
+        ожидание блокировки кэша не останавливают event loop бота
+        """
+        keys, cached, missing = await asyncio.to_thread(self._split_cached, texts)
+        vectors = await self.embeddings.aembed_documents(missing) if missing else []
+        return await asyncio.to_thread(self._merge, keys, cached, missing, vectors)
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Эмбеддинг запроса: из кэша или через модель"""
+        keys, cached, missing = self._split_cached([text])
+        vectors = [self.embeddings.embed_query(text)] if missing else []
+        return self._merge(keys, cached, missing, vectors)[0]
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        """Асинхронная версия embed_query (SQLite - в отдельном потоке)"""
+        keys, cached, missing = await asyncio.to_thread(self._split_cached, [text])
+        vectors = [await self.embeddings.aembed_query(text)] if missing else []
+        return (await asyncio.to_thread(self._merge, keys, cached, missing, vectors))[0]
@@ -5,6 +5,8 @@
 """
 
 import logging
+import time
+from collections import OrderedDict
 from string import Template
 from aiogram import Dispatcher, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -17,7 +19,7 @@ from llm.client import get_llm_response, get_llm_response_for_test
 from llm.tavily_client import search_with_tavily
 from bot.database import Database
 from bot.test_prompts import TEST_GENERATION_PROMPT
-from bot.simple_rag import SimpleRAG
+from bot.simple_rag import SimpleRAG, EMBEDDING_BATCH_SIZE
 import tempfile
 import os
 from pathlib import Path
@@ -340,6 +342,7 @@ async def handle_exit(message: Message):
     
     # Удаляем документ пользователя из базы данных
     db.clear_user_documents(user_id)
+    _user_rag_systems.pop(user_id, None)
     
     exit_text = """📄 Вы вышли из режима анализа PDF
 
@@ -627,8 +630,11 @@ async def handle_message(message: Message):
         if db.has_user_documents(user_id):
             # Режим RAG - отправляем индикатор анализа статьи
             processing_msg = await message.answer("🔎 Ищу информацию в статье...")
-            # Отвечаем по документу
-            response = await get_rag_response(text, user_id, dialog_history)
+            # Отвечаем по документу, показывая ответ по мере генерации
+            response = await get_rag_response(
+                text, user_id, dialog_history,
+                on_partial=_make_stream_editor(processing_msg)
+            )
         else:
             # Обычный режим - отправляем обычный индикатор
             processing_msg = await message.answer("🤖 Формулирую понятное объяснение...")
@@ -1516,7 +1522,7 @@ async def handle_pdf_file(message: Message):
         rag_system = SimpleRAG()
         logger.info("[PDF] SimpleRAG инициализирован")
         logger.info(f"[PDF] Начинаю обработку документа: path='{temp_path}'")
-        result = rag_system.process_pdf(temp_path)
+        result = await rag_system.aprocess_pdf(temp_path)
         logger.info(f"[PDF] Обработка завершена: success={result.get('success')}, pages={result.get('pages')}, chunks={result.get('chunks_count')}, metadata={result.get('metadata')}")
         
         if result['success']:
@@ -1620,7 +1626,103 @@ async def handle_pdf_file(message: Message):
             os.unlink(temp_path)
 
 
-async def get_rag_response(query: str, user_id: int, dialog_history: list) -> str:
+# RAG системы пользователей между вопросами: user_id -> (текст документа, SimpleRAG).
+# Векторное хранилище не перестраивается на каждый вопрос, а семантический кэш
+# ответов SimpleRAG сохраняется между вопросами пользователя. Каждая система держит
+# индекс в памяти, поэтому хранятся только недавно активные пользователи (LRU)
+USER_RAG_CACHE_SIZE = 16
+_user_rag_systems = OrderedDict()
+
+# Минимальный интервал между обновлениями сообщения при потоковом ответе RAG (секунды)
+STREAM_EDIT_INTERVAL = 1.0
+
+
+async def _build_text_rag_system(document_text: str) -> SimpleRAG:
+    """
+    Создание RAG системы по тексту документа
+    
+    Args:
+        document_text: Текст документа
+        
+    Returns:
+        SimpleRAG: RAG система с готовыми цепочками
+    """
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import InMemoryVectorStore
+    
+    rag_system = SimpleRAG()
+    
+    # Создаем документ из текста
+    doc = Document(page_content=document_text, metadata={"source": "uploaded_text"})
+    
+    # Разбиваем на чанки с умной логикой
+    chunks = rag_system._smart_chunk_split([doc])
+    
+    # Анализируем качество разбиения на чанки
+    logger.info("=" * 60)
+    logger.info("АНАЛИЗ ЧАНКОВ ПРИ ОБРАБОТКЕ ВОПРОСА")
+    logger.info("=" * 60)
+    logger.info(f"Исходный текст: {len(document_text):,} символов")
+    logger.info(f"Создано чанков: {len(chunks)}")
+    for i, chunk in enumerate(chunks):
+        logger.info(f"Чанк {i+1}: {len(chunk.page_content):3d} символов | {chunk.page_content[:80]}...")
+    logger.info("=" * 60)
+    
+    # Создаем векторное хранилище
+    try:
+        await rag_system.aensure_embeddings_started()
+        
+        # Эмбеддинги запрашиваются батчами параллельно, как и при обработке PDF
+        rag_system.vector_store = await rag_system._abuild_vector_store(chunks)
+        logger.info(f"Векторное хранилище создано успешно с {len(chunks)} чанками")
+    except Exception as e:
+        logger.error(f"Ошибка создания векторного хранилища: {e}")
+        # Fallback: добавляем батчами, пропуская только батчи с ошибкой
+        rag_system.vector_store = InMemoryVectorStore(embedding=rag_system.embeddings)
+        for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+            batch = chunks[i:i + EMBEDDING_BATCH_SIZE]
+            try:
+                await rag_system.vector_store.aadd_texts(
+                    [chunk.page_content for chunk in batch],
+                    metadatas=[chunk.metadata for chunk in batch]
+                )
+            except Exception as e2:
+                logger.error(f"Ошибка добавления чанков {i + 1}-{i + len(batch)}: {e2}")
+                continue
+    
+    # Создаем retriever
+    rag_system.retriever = rag_system._create_retriever()
+    
+    # Создаем RAG цепочки
+    rag_system._create_rag_chains()
+    
+    return rag_system
+
+
+def _make_stream_editor(processing_msg: Message):
+    """
+    Колбэк для потокового ответа: обновляет сообщение-индикатор накопленным текстом
+    
+    Telegram ограничивает частоту редактирования сообщений, поэтому текст
+    обновляется не чаще раза в STREAM_EDIT_INTERVAL секунд
+    """
+    last_edit = 0.0
+    
+    async def on_partial(text: str):
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < STREAM_EDIT_INTERVAL or not text.strip():
+            return
+        last_edit = now
+        try:
+            await processing_msg.edit_text(f"📄 Ответ RAG системы:\n{text}")
+        except Exception as e:
+            logger.debug(f"Не удалось обновить потоковый ответ: {e}")
+    
+    return on_partial
+
+
+async def get_rag_response(query: str, user_id: int, dialog_history: list, on_partial=None) -> str:
     """Получение ответа через полноценную RAG систему (как в notebook)"""
     try:
         # Получаем документ пользователя
@@ -1630,9 +1732,6 @@ async def get_rag_response(query: str, user_id: int, dialog_history: list) -> st
             logger.info(f"У пользователя {user_id} нет документа, используем обычный LLM")
             return await get_llm_response(dialog_history)
         
-        # Создаем RAG систему и загружаем документ
-        rag_system = SimpleRAG()
-        
         # Получаем путь к файлу документа (если он сохранен)
         # Пока что используем content_preview для простоты
         document_text = user_doc.get('content_preview', '')
@@ -1641,160 +1740,90 @@ async def get_rag_response(query: str, user_id: int, dialog_history: list) -> st
             logger.info(f"У документа пользователя {user_id} нет текста, используем обычный LLM")
             return await get_llm_response(dialog_history)
         
-        # Создаем временный файл с содержимым документа для RAG системы
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as temp_file:
-            temp_file.write(document_text)
-            temp_path = temp_file.name
+        # Переиспользуем RAG систему, если документ пользователя не изменился
+        cached_rag = _user_rag_systems.get(user_id)
+        if cached_rag is not None and cached_rag[0] == document_text:
+            logger.info(f"Используем уже построенную RAG систему пользователя {user_id}")
+            rag_system = cached_rag[1]
+            _user_rag_systems.move_to_end(user_id)
+        else:
+            logger.info("Обрабатываю текстовый файл как документ")
+            rag_system = await _build_text_rag_system(document_text)
+            _user_rag_systems[user_id] = (document_text, rag_system)
+            _user_rag_systems.move_to_end(user_id)
+            if len(_user_rag_systems) > USER_RAG_CACHE_SIZE:
+                _user_rag_systems.popitem(last=False)
         
-        try:
-            # Обрабатываем документ через RAG систему
-            # Проверяем, что это действительно PDF файл
-            if temp_path.endswith('.txt'):
-                # Для текстовых файлов используем простой подход
-                logger.info("Обрабатываю текстовый файл как документ")
-                
-                # Создаем простую RAG систему без PDF парсинга
-                rag_system = SimpleRAG()
-                
-                # Создаем временный PDF файл с содержимым
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.pdf') as pdf_temp:
-                    # Записываем содержимое как простой текст
-                    pdf_temp.write(document_text)
-                    pdf_temp_path = pdf_temp.name
-                
-                try:
-                    # Используем простой подход - создаем векторное хранилище напрямую
-                    from langchain_text_splitters import RecursiveCharacterTextSplitter
-                    from langchain_core.documents import Document
-                    from langchain_core.vectorstores import InMemoryVectorStore
-                    
-                    # Создаем документ из текста
-                    doc = Document(page_content=document_text, metadata={"source": "uploaded_text"})
-                    
-                    # Разбиваем на чанки с умной логикой
-                    chunks = rag_system._smart_chunk_split([doc], chunk_size=400, overlap=100)
-                    
-                    # Анализируем качество разбиения на чанки
-                    logger.info("=" * 60)
-                    logger.info("АНАЛИЗ ЧАНКОВ ПРИ ОБРАБОТКЕ ВОПРОСА")
-                    logger.info("=" * 60)
-                    logger.info(f"Исходный текст: {len(document_text):,} символов")
-                    logger.info(f"Создано чанков: {len(chunks)}")
-                    for i, chunk in enumerate(chunks):
-                        logger.info(f"Чанк {i+1}: {len(chunk.page_content):3d} символов | {chunk.page_content[:80]}...")
-                    logger.info("=" * 60)
-                    
-                    # Создаем векторное хранилище
-                    try:
-                        # Используем from_documents для создания векторного хранилища
-                        rag_system.vector_store = InMemoryVectorStore.from_documents(
-                            chunks,
-                            embedding=rag_system.embeddings
-                        )
-                        logger.info(f"Векторное хранилище создано успешно с {len(chunks)} чанками")
-                    except Exception as e:
-                        logger.error(f"Ошибка создания векторного хранилища через from_documents: {e}")
-                        # Fallback: добавляем по одному
-                        rag_system.vector_store = InMemoryVectorStore(embedding=rag_system.embeddings)
-                        for chunk in chunks:
-                            try:
-                                rag_system.vector_store.add_texts([chunk.page_content], [chunk.metadata])
-                            except Exception as e2:
-                                logger.error(f"Ошибка добавления чанка: {e2}")
-                                continue
-                    
-                    # Создаем retriever
-                    rag_system.retriever = rag_system.vector_store.as_retriever(search_kwargs={'k': 3})
-                    
-                    # Создаем RAG цепочки
-                    rag_system._create_rag_chains()
-                    
-                finally:
-                    if os.path.exists(pdf_temp_path):
-                        os.unlink(pdf_temp_path)
-            else:
-                # Для PDF файлов используем обычную обработку
-                result = rag_system.process_pdf(temp_path)
-                
-                if not result['success']:
-                    logger.error(f"Ошибка обработки документа для RAG: {result['error']}")
-                    return await get_llm_response(dialog_history)
-            
-            # Используем полноценную RAG систему для ответа
-            rag_result = rag_system.answer_question(query, dialog_history)
-            
-            logger.info(f"RAG результат: source={rag_result['source']}, quality={rag_result['quality']}, chunks={rag_result.get('chunks_used', 0)}")
-            
-            if rag_result['source'] == 'error':
-                logger.error(f"Ошибка RAG ответа: {rag_result['answer']}")
-                return await get_llm_response(dialog_history)
-            
-            # Формируем ответ с префиксом в зависимости от источника и качества
-            quality = rag_result.get('quality', 'low')
-            chunks_used = rag_result.get('chunks_used', 0)
+        # Используем полноценную RAG систему для ответа
+        rag_result = await rag_system.aanswer_question(query, dialog_history, on_partial=on_partial)
+        
+        logger.info(f"RAG результат: source={rag_result['source']}, quality={rag_result['quality']}, chunks={rag_result.get('chunks_used', 0)}")
+        
+        if rag_result['source'] == 'error':
+            logger.error(f"Ошибка RAG ответа: {rag_result['answer']}")
+            return await get_llm_response(dialog_history)
+        
+        # Формируем ответ с префиксом в зависимости от источника и качества
+        quality = rag_result.get('quality', 'low')
+        chunks_used = rag_result.get('chunks_used', 0)
+        
+        logger.info(f"🎯 Принятие решения о показе дополнительной информации:")
+        logger.info(f"   - Источник: {rag_result['source']}")
+        logger.info(f"   - Качество: {quality}")
+        logger.info(f"   - Использовано чанков: {chunks_used}")
+        logger.info(f"   - Длина ответа RAG: {len(rag_result.get('answer', ''))} символов")
+        
+        if rag_result['source'] == 'document':
+            # RAG нашла полноценный ответ в документе - показываем только его
+            logger.info(f"✅ source='document', quality='{quality}' → показываем ТОЛЬКО RAG ответ")
+            response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
+        elif rag_result['source'] == 'document_partial':
+            # RAG нашла частичный ответ в документе - показываем только его
+            logger.info(f"✅ source='document_partial', quality='{quality}' → показываем ТОЛЬКО RAG ответ")
+            response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
+        else:  # not_found
+            # RAG система не нашла информацию в документе
+            logger.info(f"⚠️ source='not_found', quality='{quality}'")
             
-            logger.info(f"🎯 Принятие решения о показе дополнительной информации:")
-            logger.info(f"   - Источник: {rag_result['source']}")
-            logger.info(f"   - Качество: {quality}")
-            logger.info(f"   - Использовано чанков: {chunks_used}")
-            logger.info(f"   - Длина ответа RAG: {len(rag_result.get('answer', ''))} символов")
+            # Сначала показываем ответ RAG системы
+            response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
             
-            if rag_result['source'] == 'document':
-                # RAG нашла полноценный ответ в документе - показываем только его
-                logger.info(f"✅ source='document', quality='{quality}' → показываем ТОЛЬКО RAG ответ")
-                response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
-            elif rag_result['source'] == 'document_partial':
-                # RAG нашла частичный ответ в документе - показываем только его
-                logger.info(f"✅ source='document_partial', quality='{quality}' → показываем ТОЛЬКО RAG ответ")
-                response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
-            else:  # not_found
-                # RAG система не нашла информацию в документе
-                logger.info(f"⚠️ source='not_found', quality='{quality}'")
+            # Если качество ответа низкое, добавляем общий ответ и веб-поиск
+            if quality == 'low':
+                logger.info(f"🔻 Качество 'low' → добавляем общий LLM ответ и веб-поиск")
+                # Получаем общий ответ от базового промпта
+                general_response = await get_llm_response(dialog_history)
                 
-                # Сначала показываем ответ RAG системы
-                response = f"📄 Ответ RAG системы:\n{rag_result['answer']}"
+                # Убираем фразу "Могу рассказать про..." из ответа
+                import re
+                general_response = re.sub(r'\n\nМогу рассказать про.*?Хочешь\?', '', general_response, flags=re.DOTALL)
+                general_response = re.sub(r'Могу рассказать про.*?Хочешь\?', '', general_response, flags=re.DOTALL)
                 
-                # Если качество ответа низкое, добавляем общий ответ и веб-поиск
-                if quality == 'low':
-                    logger.info(f"🔻 Качество 'low' → добавляем общий LLM ответ и веб-поиск")
-                    # Получаем общий ответ от базового промпта
-                    general_response = await get_llm_response(dialog_history)
-                    
-                    # Убираем фразу "Могу рассказать про..." из ответа
-                    import re
-                    general_response = re.sub(r'\n\nМогу рассказать про.*?Хочешь\?', '', general_response, flags=re.DOTALL)
-                    general_response = re.sub(r'Могу рассказать про.*?Хочешь\?', '', general_response, flags=re.DOTALL)
-                    
-                    # Убираем префиксы RAG системы из общего ответа
-                    general_response = re.sub(r'📄 Ответ RAG системы:\s*', '', general_response)
-                    general_response = re.sub(r'^Ответ RAG системы:\s*\n?', '', general_response, flags=re.MULTILINE)  # Удаляем без emoji
-                    general_response = re.sub(r'📄 Ответ на основе документа:\s*', '', general_response)
-                    general_response = re.sub(r'📄 Ответ на основе документа \(частично\):\s*', '', general_response)
-                    
-                    # Добавляем общий ответ
-                    response += f"\n\n💡 Общий ответ:\n{general_response}"
-                    
-                    # Попытка веб-поиска через Tavily
-                    logger.info(f"🌐 Пытаемся выполнить веб-поиск для вопроса: {query[:50]}...")
-                    web_response = await search_with_tavily(query, max_results=2)
-                    if web_response:
-                        logger.info(f"✅ Веб-поиск вернул результаты (длина: {len(web_response)} символов)")
-                        response += f"\n\n🌐 Дополнительная информация:\n{web_response}"
-                    else:
-                        logger.info("⚠️ Веб-поиск не вернул результатов или недоступен")
+                # Убираем префиксы RAG системы из общего ответа
+                general_response = re.sub(r'📄 Ответ RAG системы:\s*', '', general_response)
+                general_response = re.sub(r'^Ответ RAG системы:\s*\n?', '', general_response, flags=re.MULTILINE)  # Удаляем без emoji
+                general_response = re.sub(r'📄 Ответ на основе документа:\s*', '', general_response)
+                general_response = re.sub(r'📄 Ответ на основе документа \(частично\):\s*', '', general_response)
+                
+                # Добавляем общий ответ
+                response += f"\n\n💡 Общий ответ:\n{general_response}"
+                
+                # Попытка веб-поиска через Tavily
+                logger.info(f"🌐 Пытаемся выполнить веб-поиск для вопроса: {query[:50]}...")
+                web_response = await search_with_tavily(query, max_results=2)
+                if web_response:
+                    logger.info(f"✅ Веб-поиск вернул результаты (длина: {len(web_response)} символов)")
+                    response += f"\n\n🌐 Дополнительная информация:\n{web_response}"
                 else:
-                    logger.info(f"🔼 Качество '{quality}' → показываем ТОЛЬКО RAG ответ без общего LLM и веб-поиска")
-            
-            # Добавляем напоминание о команде /exit
-            response += "\n\n💡 Для выхода из режима анализа документа используйте команду /exit"
-            
-            logger.info(f"RAG ответ для пользователя {user_id} (источник: {rag_result['source']})")
-            return response
-            
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+                    logger.info("⚠️ Веб-поиск не вернул результатов или недоступен")
+            else:
+                logger.info(f"🔼 Качество '{quality}' → показываем ТОЛЬКО RAG ответ без общего LLM и веб-поиска")
+        
+        # Добавляем напоминание о команде /exit
+        response += "\n\n💡 Для выхода из режима анализа документа используйте команду /exit"
+        
+        logger.info(f"RAG ответ для пользователя {user_id} (источник: {rag_result['source']})")
+        return response
         
     except Exception as e:
         logger.error(f"Ошибка RAG для пользователя {user_id}: {e}")
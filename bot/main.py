@@ -22,6 +22,9 @@ def setup_logging():
         level=getattr(logging, log_level),
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
+    
+    # HTTP-клиенты OpenAI/LangChain пишут строку на каждый запрос к API
+    logging.getLogger('httpx').setLevel(logging.WARNING)
 
 
 async def setup_bot_commands(bot: Bot):
@@ -135,7 +135,7 @@ def get_course_stats(user_id: int, course_type: str) -> Dict[str, int]:
         Dict[str, int]: Статистика {completed, total, percentage}
     """
     progress = get_course_progress(user_id, course_type)
-    completed = sum(1 for is_done in progress.values() if is_done)
+    completed = sum(progress.values())
     total = len(progress)
     percentage = int((completed / total) * 100) if total > 0 else 0
     
@@ -5,21 +5,35 @@ import re
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 
-try:
-    import PyPDF2
-except ImportError:
-    PyPDF2 = None
-    logging.warning("PyPDF2 не установлен. Обработка PDF недоступна.")
+# PyPDF2 импортируется лениво при создании DocumentProcessor,
+# чтобы не замедлять запуск бота, если PDF так и не понадобятся
+PyPDF2 = None
 
 logger = logging.getLogger(__name__)
 
+# Служебные слова, по которым отсеиваем строки с адресами и заголовками разделов.
+# Одна скомпилированная альтернатива проверяет все слова за один проход по строке
+_ADDRESS_WORDS_RE = re.compile(r'email|@|university|department')
+_SECTION_WORDS_RE = re.compile(r'abstract|introduction|arxiv|doi')
+
+
+def _load_pypdf2():
+    """Ленивый импорт PyPDF2 при первом обращении"""
+    global PyPDF2
+    if PyPDF2 is None:
+        try:
+            import PyPDF2 as pypdf2_module
+        except ImportError:
+            raise ImportError("PyPDF2 не установлен. Установите: pip install PyPDF2")
+        PyPDF2 = pypdf2_module
+    return PyPDF2
+
 
 class DocumentProcessor:
     """Класс для обработки PDF документов"""
     
     def __init__(self):
-        if PyPDF2 is None:
-            raise ImportError("PyPDF2 не установлен. Установите: pip install PyPDF2")
+        _load_pypdf2()
     
     def process_pdf(self, file_path: str) -> Dict[str, Any]:
         """
@@ -76,7 +90,7 @@ class DocumentProcessor:
         
         return text.strip()
     
-    def _extract_metadata(self, text: str, pdf_reader: PyPDF2.PdfReader) -> Dict[str, Any]:
+    def _extract_metadata(self, text: str, pdf_reader: 'PyPDF2.PdfReader') -> Dict[str, Any]:
         """Извлечение метаданных из PDF"""
         metadata = {
             'pages': len(pdf_reader.pages),
@@ -84,28 +98,30 @@ class DocumentProcessor:
         }
         
         # Пытаемся извлечь информацию из первых строк
-        lines = text.split('\n')[:20]  # Первые 20 строк
+        # maxsplit останавливает разбиение после 20 строк, не трогая остальной текст
+        lines = text.split('\n', 20)[:20]  # Первые 20 строк
         
         # Ищем ArXiv ID
-        arxiv_id = self._find_arxiv_id(lines)
+        arxiv_id = self._find_arxiv_id(lines, limit=20)
         if arxiv_id:
             metadata['arxiv_id'] = arxiv_id
         
         # Ищем авторов
-        authors = self._find_authors(lines)
+        authors = self._find_authors(lines, limit=10)
         if authors:
             metadata['authors'] = authors
         
         # Ищем название статьи
-        title = self._find_title(lines)
+        title = self._find_title(lines, limit=5)
         if title:
             metadata['title'] = title
         
         return metadata
     
-    def _find_arxiv_id(self, lines: List[str]) -> Optional[str]:
+    def _find_arxiv_id(self, lines: List[str], limit: int = 20) -> Optional[str]:
         """Поиск ArXiv ID в тексте"""
-        for line in lines:
+        for i in range(min(limit, len(lines))):
+            line = lines[i]
             # Паттерны для ArXiv ID
             patterns = [
                 r'arXiv:(\d+\.\d+)',
@@ -120,10 +136,10 @@ class DocumentProcessor:
         
         return None
     
-    def _find_authors(self, lines: List[str]) -> Optional[str]:
+    def _find_authors(self, lines: List[str], limit: int = 10) -> Optional[str]:
         """Поиск авторов в тексте"""
-        for i, line in enumerate(lines[:10]):  # Ищем в первых 10 строках
-            line = line.strip()
+        for i in range(min(limit, len(lines))):  # Ищем в первых limit строках
+            line = lines[i].strip()
             
             # Пропускаем пустые строки и заголовки
             if not line or len(line) < 3:
@@ -132,15 +148,15 @@ class DocumentProcessor:
             # Ищем строки с фамилиями (содержат запятые или "and")
             if ',' in line or ' and ' in line.lower():
                 # Проверяем, что это не адрес или другая информация
-                if not any(word in line.lower() for word in ['email', '@', 'university', 'department']):
+                if not _ADDRESS_WORDS_RE.search(line.lower()):
                     return line
         
         return None
     
-    def _find_title(self, lines: List[str]) -> Optional[str]:
+    def _find_title(self, lines: List[str], limit: int = 5) -> Optional[str]:
         """Поиск названия статьи"""
-        for i, line in enumerate(lines[:5]):  # Ищем в первых 5 строках
-            line = line.strip()
+        for i in range(min(limit, len(lines))):  # Ищем в первых limit строках
+            line = lines[i].strip()
             
             # Пропускаем пустые строки
             if not line:
@@ -148,7 +164,7 @@ class DocumentProcessor:
             
             # Название обычно длинное и не содержит служебных слов
             if (len(line) > 10 and 
-                not any(word in line.lower() for word in ['abstract', 'introduction', 'arxiv', 'doi']) and
+                not _SECTION_WORDS_RE.search(line.lower()) and
                 not line.isupper()):  # Не все заглавные
                 return line
         
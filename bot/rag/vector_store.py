@@ -2,18 +2,124 @@
 
 import logging
 import os
+import platform
+import re
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 
 try:
     import chromadb
+    import numpy as np
+    import torch
     from sentence_transformers import SentenceTransformer
 except ImportError:
     chromadb = None
+    np = None
+    torch = None
     SentenceTransformer = None
     logging.warning("ChromaDB или SentenceTransformers не установлены. RAG недоступен.")
 
+# Исключения ChromaDB об отсутствующей коллекции: старые версии бросают ValueError,
+# новые - собственные классы ошибок
+_COLLECTION_NOT_FOUND_ERRORS = (ValueError,)
+try:
+    from chromadb.errors import InvalidCollectionException
+    _COLLECTION_NOT_FOUND_ERRORS += (InvalidCollectionException,)
+except ImportError:
+    pass
+try:
+    from chromadb.errors import NotFoundError
+    _COLLECTION_NOT_FOUND_ERRORS += (NotFoundError,)
+except ImportError:
+    pass
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
 logger = logging.getLogger(__name__)
 
+# Модель эмбеддингов (легкая модель)
+EMBEDDINGS_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Число потоков PyTorch при кодировании на CPU
+CPU_THREADS = os.cpu_count() or 4
+
+# Общая коллекция всех пользователей из прежних версий бота;
+# при запуске ее чанки переносятся в коллекции пользователей
+LEGACY_COLLECTION_NAME = "ml_documents"
+
+# Размер порции чанков при переносе из общей коллекции
+MIGRATION_BATCH_SIZE = 1000
+
+# Квантованные ONNX-экспорты модели в ее репозитории на HF Hub. Каждый собран под свой
+# набор инструкций: AVX2 использует веса uint8 (quint8), остальные - int8 (qint8)
+ONNX_QUANTIZED_EXPORTS = (
+    'onnx/model_qint8_arm64.onnx',
+    'onnx/model_qint8_avx512.onnx',
+    'onnx/model_qint8_avx512_vnni.onnx',
+    'onnx/model_quint8_avx2.onnx',
+)
+
+
+def _cpu_flags() -> frozenset:
+    """Флаги процессора из /proc/cpuinfo (пустое множество, если файла нет)"""
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('flags'):
+                    return frozenset(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return frozenset()
+
+
+def _select_onnx_model_file(machine: str, cpu_flags: frozenset) -> str:
+    """
+    Квантованный ONNX-экспорт под архитектуру и набор инструкций процессора
+    
+    Args:
+        machine: Архитектура (platform.machine())
+        cpu_flags: Флаги процессора
+        
+    Returns:
+        Путь к файлу модели в репозитории HF Hub
+    """
+    if machine.lower() in ('aarch64', 'arm64'):
+        return 'onnx/model_qint8_arm64.onnx'
+    if 'avx512_vnni' in cpu_flags:
+        return 'onnx/model_qint8_avx512_vnni.onnx'
+    if 'avx512f' in cpu_flags:
+        return 'onnx/model_qint8_avx512.onnx'
+    return 'onnx/model_quint8_avx2.onnx'
+
+
+# Экспорт для инференса на CPU этой машины
+ONNX_INT8_MODEL_FILE = _select_onnx_model_file(platform.machine(), _cpu_flags())
+
+# Размер батча при кодировании чанков
+ENCODE_BATCH_SIZE = 64
+
+# Масштаб скалярного квантования нормализованных эмбеддингов в int8
+INT8_SCALE = 127
+
+# Размер LRU-кэша эмбеддингов запросов
+QUERY_CACHE_SIZE = 1024
+
+# Число пользователей, чьи int8-индексы одновременно держатся в памяти;
+# вытесненный индекс заново загружается из ChromaDB при следующем поиске
+USER_INDEX_CACHE_SIZE = 32
+
+# Пробелы и завершающая пунктуация не влияют на смысл запроса
+_QUERY_SPACES_RE = re.compile(r'\s+')
+_QUERY_TRAILING_PUNCT_RE = re.compile(r'[\s\.\,\!\?\;\:]+$')
+
 
 class VectorStore:
     """Класс для работы с векторным хранилищем ChromaDB"""
@@ -28,7 +134,15 @@ class VectorStore:
         self.persist_directory = persist_directory
         self.embeddings_model = None
         self.chroma_client = None
-        self.collection = None
+        # Коллекции ChromaDB по пользователям: user_id -> Collection
+        self._collections = {}
+        # Кэш эмбеддингов запросов: нормализованный текст -> эмбеддинг
+        self._query_cache = OrderedDict()
+        # LRU квантованных int8 эмбеддингов пользователей для поиска в памяти:
+        # user_id -> {'vectors', 'norms', 'ids', 'documents', 'metadatas'}
+        self._user_index = OrderedDict()
+        # ID чанков по документам: user_id -> {document_id: [chroma_id, ...]}
+        self._doc_index = {}
         
         self._initialize()
     
@@ -40,21 +154,34 @@ class VectorStore:
             
             # Инициализируем модель эмбеддингов (легкая модель)
             logger.info("Загружаю модель эмбеддингов...")
-            self.embeddings_model = SentenceTransformer(
-                'sentence-transformers/all-MiniLM-L6-v2'
-            )
+            use_cuda = torch.cuda.is_available()
+            
+            # На CPU используем int8 ONNX-модель через ONNX Runtime, если он установлен
+            if onnxruntime is not None and not use_cuda:
+                try:
+                    self.embeddings_model = SentenceTransformer(
+                        EMBEDDINGS_MODEL_NAME,
+                        backend="onnx",
+                        model_kwargs={"file_name": ONNX_INT8_MODEL_FILE}
+                    )
+                    logger.info("Модель эмбеддингов загружена через ONNX Runtime (int8)")
+                except Exception as e:
+                    logger.warning(f"Не удалось загрузить ONNX-модель, используем PyTorch: {e}")
+            
+            if self.embeddings_model is None:
+                if not use_cuda:
+                    self._configure_torch_threads()
+                self.embeddings_model = SentenceTransformer(EMBEDDINGS_MODEL_NAME)
+                if use_cuda:
+                    logger.info("Переношу модель эмбеддингов на GPU (fp16)")
+                    self.embeddings_model = self.embeddings_model.half().to('cuda')
+            
+            self.embeddings_model.max_seq_length = 256
             
             # Инициализируем ChromaDB
             logger.info("Инициализирую ChromaDB...")
             self.chroma_client = chromadb.PersistentClient(path=self.persist_directory)
-            
-            # Создаем или получаем коллекцию
-            try:
-                self.collection = self.chroma_client.get_collection("ml_documents")
-                logger.info("Найдена существующая коллекция ml_documents")
-            except:
-                self.collection = self.chroma_client.create_collection("ml_documents")
-                logger.info("Создана новая коллекция ml_documents")
+            self._migrate_legacy_collection()
             
             logger.info("VectorStore инициализирован успешно")
             
@@ -62,6 +189,92 @@ class VectorStore:
             logger.error(f"Ошибка инициализации VectorStore: {e}")
             raise
     
+    def _configure_torch_threads(self):
+        """Настройка потоков PyTorch, чтобы кодирование на CPU занимало все ядра"""
+        torch.set_num_threads(CPU_THREADS)
+        try:
+            torch.set_num_interop_threads(2)
+        except RuntimeError as e:
+            # Число interop-потоков можно задать только до первой параллельной операции
+            logger.debug(f"Не удалось изменить число interop-потоков PyTorch: {e}")
+        
+        logger.info(f"PyTorch использует {torch.get_num_threads()} потоков на CPU")
+    
+    def _collection_name(self, user_id: int) -> str:
+        """Имя коллекции пользователя"""
+        return f"user_{user_id}"
+    
+    def _find_collection(self, name: str):
+        """Существующая коллекция ChromaDB или None, если ее нет (без создания пустой)"""
+        try:
+            return self.chroma_client.get_collection(name)
+        except _COLLECTION_NOT_FOUND_ERRORS:
+            return None
+    
+    def _migrate_legacy_collection(self):
+        """
+        Однократный перенос чанков из общей коллекции ml_documents в коллекции пользователей
+        
+        Старые эмбеддинги не нормализованы, а int8-квантование индекса в памяти
+        рассчитано на единичные векторы, поэтому они нормализуются при переносе.
+        Перенос идет через upsert, так что прерванная миграция безопасно повторяется;
+        общая коллекция удаляется только после переноса всех чанков
+        """
+        legacy = self._find_collection(LEGACY_COLLECTION_NAME)
+        if legacy is None:
+            return
+        
+        total = legacy.count()
+        logger.info(f"Переношу {total} чанков из {LEGACY_COLLECTION_NAME} в коллекции пользователей...")
+        
+        for offset in range(0, total, MIGRATION_BATCH_SIZE):
+            results = legacy.get(
+                include=['embeddings', 'documents', 'metadatas'],
+                limit=MIGRATION_BATCH_SIZE,
+                offset=offset
+            )
+            if not results['ids']:
+                break
+            
+            embeddings = np.asarray(results['embeddings'], dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embeddings = embeddings / norms
+            
+            # Группируем чанки порции по пользователям
+            by_user = {}
+            for i, metadata in enumerate(results['metadatas']):
+                by_user.setdefault(metadata.get('user_id'), []).append(i)
+            
+            for user_id, positions in by_user.items():
+                if user_id is None:
+                    logger.warning(f"Пропускаю {len(positions)} чанков без user_id в {LEGACY_COLLECTION_NAME}")
+                    continue
+                self._get_collection(user_id).upsert(
+                    ids=[results['ids'][i] for i in positions],
+                    embeddings=embeddings[positions],
+                    documents=[results['documents'][i] for i in positions],
+                    metadatas=[results['metadatas'][i] for i in positions]
+                )
+        
+        self.chroma_client.delete_collection(LEGACY_COLLECTION_NAME)
+        logger.info(f"Коллекция {LEGACY_COLLECTION_NAME} перенесена и удалена")
+    
+    def _get_collection(self, user_id: int):
+        """
+        Коллекция ChromaDB пользователя (создается при первом обращении)
+        
+        Отдельная коллекция на пользователя избавляет от фильтра where по user_id:
+        загрузка индекса и удаление затрагивают только векторы этого пользователя.
+        ChromaDB служит только постоянным хранилищем: поиск идет по int8-индексу
+        в памяти, поэтому HNSW-индекс коллекции не используется и не настраивается
+        """
+        collection = self._collections.get(user_id)
+        if collection is None:
+            collection = self.chroma_client.get_or_create_collection(self._collection_name(user_id))
+            self._collections[user_id] = collection
+        return collection
+    
     def add_document(self, document_id: int, chunks: List[str], metadata: Dict[str, Any], user_id: int):
         """
         Добавление документа в векторное хранилище
@@ -79,31 +292,34 @@ class VectorStore:
             
             # Создаем эмбеддинги для чанков
             logger.info(f"Создаю эмбеддинги для {len(chunks)} чанков...")
-            embeddings = self.embeddings_model.encode(chunks)
+            embeddings = self._encode(chunks)
             
             # Подготавливаем данные для ChromaDB
             ids = [f"{user_id}_{document_id}_{i}" for i in range(len(chunks))]
             
-            # Добавляем метаданные к каждому чанку
-            metadatas = []
-            for i, chunk in enumerate(chunks):
-                chunk_metadata = {
-                    **metadata,
-                    'user_id': user_id,
-                    'document_id': document_id,
-                    'chunk_index': i,
-                    'chunk_count': len(chunks)
-                }
-                metadatas.append(chunk_metadata)
+            # Общие метаданные документа собираем один раз, у чанков отличается только индекс.
+            # Число чанков документа не хранится в каждом чанке, оно считается в get_user_stats
+            base_metadata = {
+                **metadata,
+                'user_id': user_id,
+                'document_id': document_id
+            }
+            metadatas = [base_metadata | {'chunk_index': i} for i in range(len(chunks))]
             
-            # Добавляем в коллекцию
-            self.collection.add(
+            # Добавляем в коллекцию пользователя
+            self._get_collection(user_id).add(
                 ids=ids,
-                embeddings=embeddings.tolist(),
+                embeddings=embeddings,
                 documents=chunks,
                 metadatas=metadatas
             )
             
+            # Дополняем индексы пользователя в памяти, если они уже загружены
+            if user_id in self._user_index:
+                self._extend_user_index(user_id, embeddings, ids, chunks, metadatas)
+            if user_id in self._doc_index:
+                self._doc_index[user_id].setdefault(document_id, []).extend(ids)
+            
             logger.info(f"Добавлен документ {document_id} с {len(chunks)} чанками для пользователя {user_id}")
             
         except Exception as e:
@@ -123,25 +339,28 @@ class VectorStore:
             Список релевантных документов с метаданными
         """
         try:
-            # Создаем эмбеддинг для запроса
-            query_embedding = self.embeddings_model.encode([query])
-            
-            # Поиск в ChromaDB с фильтром по пользователю
-            results = self.collection.query(
-                query_embeddings=query_embedding.tolist(),
-                n_results=n_results,
-                where={"user_id": user_id}
-            )
+            # Создаем эмбеддинг для запроса (или берем из кэша)
+            query_embedding = self._encode_query(query)
             
-            # Форматируем результаты
+            # Поиск по квантованному индексу пользователя в памяти
+            index = self._get_user_index(user_id)
             formatted_results = []
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
+            if index['ids']:
+                distances = self._int8_cosine_distances(self._quantize(query_embedding)[0], index)
+                
+                # Выбираем top-k без полной сортировки
+                k = min(n_results, len(distances))
+                top = np.argpartition(distances, k - 1)[:k]
+                top = top[np.argsort(distances[top])]
+                
+                # Форматируем результаты
+                for i in top:
+                    distance = float(distances[i])
                     formatted_results.append({
-                        'content': doc,
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i] if results['distances'] else 0,
-                        'similarity': 1 - results['distances'][0][i] if results['distances'] else 0
+                        'content': index['documents'][i],
+                        'metadata': index['metadatas'][i],
+                        'distance': distance,
+                        'similarity': 1 - distance
                     })
             
             logger.info(f"Найдено {len(formatted_results)} релевантных документов для пользователя {user_id}")
@@ -151,6 +370,142 @@ class VectorStore:
             logger.error(f"Ошибка поиска в векторном хранилище: {e}")
             return []
     
+    def _encode(self, texts: List[str]):
+        """Батчевое кодирование текстов в нормализованные эмбеддинги float32"""
+        with torch.inference_mode():
+            embeddings = self.embeddings_model.encode(
+                texts,
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        return embeddings.astype(np.float32, copy=False)
+    
+    def _quantize(self, embeddings):
+        """Скалярное квантование нормализованных эмбеддингов в int8"""
+        return np.clip(np.round(embeddings * INT8_SCALE), -128, 127).astype(np.int8)
+    
+    def _int8_cosine_distances(self, query_vector, index: Dict[str, Any]):
+        """
+        Косинусные расстояния от запроса до всех векторов индекса
+        
+        Использует int8-ядра SimSIMD, если библиотека установлена,
+        иначе целочисленное матричное умножение NumPy
+        """
+        if simsimd is not None:
+            return np.asarray(
+                simsimd.cdist(query_vector[np.newaxis, :], index['vectors'], metric="cosine"),
+                dtype=np.float32
+            )[0]
+        
+        dots = index['vectors'].astype(np.int32) @ query_vector.astype(np.int32)
+        query_norm = np.linalg.norm(query_vector.astype(np.float32)) or 1.0
+        return 1 - dots / (index['norms'] * query_norm)
+    
+    def _get_user_index(self, user_id: int) -> Dict[str, Any]:
+        """
+        Индекс пользователя в памяти; при первом обращении загружается из ChromaDB
+        
+        В памяти держатся индексы USER_INDEX_CACHE_SIZE последних пользователей,
+        давно не искавшие вытесняются
+        """
+        index = self._user_index.get(user_id)
+        if index is not None:
+            self._user_index.move_to_end(user_id)
+            return index
+        
+        results = self._get_collection(user_id).get(
+            include=['embeddings', 'documents', 'metadatas']
+        )
+        self._user_index[user_id] = {
+            'vectors': np.empty((0, 0), dtype=np.int8),
+            'norms': np.empty(0, dtype=np.float32),
+            'ids': [],
+            'documents': [],
+            'metadatas': []
+        }
+        if results['ids']:
+            self._extend_user_index(
+                user_id,
+                np.asarray(results['embeddings'], dtype=np.float32),
+                results['ids'],
+                results['documents'],
+                results['metadatas']
+            )
+        
+        index = self._user_index[user_id]
+        if len(self._user_index) > USER_INDEX_CACHE_SIZE:
+            self._user_index.popitem(last=False)
+        return index
+    
+    def _get_doc_index(self, user_id: int) -> Dict[int, List[str]]:
+        """
+        ID чанков пользователя, сгруппированные по документам
+        
+        Загружается из коллекции одним запросом при первом обращении,
+        дальше поддерживается в памяти при добавлении и удалении документов
+        """
+        doc_index = self._doc_index.get(user_id)
+        if doc_index is not None:
+            return doc_index
+        
+        results = self._get_collection(user_id).get(include=['metadatas'])
+        doc_index = {}
+        for chunk_id, metadata in zip(results['ids'], results['metadatas']):
+            doc_index.setdefault(metadata.get('document_id'), []).append(chunk_id)
+        
+        self._doc_index[user_id] = doc_index
+        return doc_index
+    
+    def _extend_user_index(self, user_id: int, embeddings, ids: List[str],
+                           documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Добавление эмбеддингов в индекс пользователя в памяти"""
+        index = self._user_index[user_id]
+        vectors = self._quantize(embeddings)
+        norms = np.linalg.norm(vectors.astype(np.float32), axis=1)
+        norms[norms == 0] = 1.0
+        
+        if index['ids']:
+            index['vectors'] = np.vstack([index['vectors'], vectors])
+            index['norms'] = np.concatenate([index['norms'], norms])
+        else:
+            index['vectors'] = vectors
+            index['norms'] = norms
+        index['ids'].extend(ids)
+        index['documents'].extend(documents)
+        index['metadatas'].extend(metadatas)
+    
+    def _encode_query(self, query: str):
+        """
+        Эмбеддинг запроса с LRU-кэшем по нормализованному тексту
+        
+        Повторные вопросы в чате не прогоняются через модель повторно
+        
+        Args:
+            query: Поисковый запрос
+            
+        Returns:
+            Эмбеддинг запроса в форме (1, dim)
+        """
+        key = _QUERY_SPACES_RE.sub(' ', query.strip().lower())
+        key = _QUERY_TRAILING_PUNCT_RE.sub('', key)
+        
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            self._query_cache.move_to_end(key)
+            return cached
+        
+        query_embedding = self._encode([query])
+        # Один и тот же массив отдается всем вызывающим, поэтому запрещаем его изменение
+        query_embedding.setflags(write=False)
+        
+        self._query_cache[key] = query_embedding
+        if len(self._query_cache) > QUERY_CACHE_SIZE:
+            self._query_cache.popitem(last=False)
+        
+        return query_embedding
+    
     def delete_user_documents(self, user_id: int):
         """
         Удаление всех документов пользователя
@@ -159,13 +514,20 @@ class VectorStore:
             user_id: ID пользователя
         """
         try:
-            # Получаем все документы пользователя
-            results = self.collection.get(where={"user_id": user_id})
+            self._user_index.pop(user_id, None)
+            self._doc_index.pop(user_id, None)
+            
+            # Ищем коллекцию пользователя, не создавая пустую ради подсчета
+            collection = self._collections.get(user_id)
+            if collection is None:
+                collection = self._find_collection(self._collection_name(user_id))
+            chunks_count = collection.count() if collection is not None else 0
             
-            if results['ids']:
-                # Удаляем документы
-                self.collection.delete(ids=results['ids'])
-                logger.info(f"Удалены документы пользователя {user_id}: {len(results['ids'])} чанков")
+            if chunks_count:
+                # Удаляем коллекцию пользователя целиком
+                self.chroma_client.delete_collection(self._collection_name(user_id))
+                self._collections.pop(user_id, None)
+                logger.info(f"Удалены документы пользователя {user_id}: {chunks_count} чанков")
             else:
                 logger.info(f"У пользователя {user_id} нет документов в векторном хранилище")
             
@@ -181,13 +543,14 @@ class VectorStore:
             document_id: ID документа
         """
         try:
-            # Получаем документ пользователя
-            results = self.collection.get(where={"user_id": user_id, "document_id": document_id})
+            self._user_index.pop(user_id, None)
             
-            if results['ids']:
-                # Удаляем документ
-                self.collection.delete(ids=results['ids'])
-                logger.info(f"Удален документ {document_id} пользователя {user_id}: {len(results['ids'])} чанков")
+            # ID чанков берем из индекса в памяти, без фильтрации where в ChromaDB
+            ids = self._get_doc_index(user_id).pop(document_id, [])
+            
+            if ids:
+                self._get_collection(user_id).delete(ids=ids)
+                logger.info(f"Удален документ {document_id} пользователя {user_id}: {len(ids)} чанков")
             else:
                 logger.info(f"Документ {document_id} пользователя {user_id} не найден в векторном хранилище")
             
@@ -205,25 +568,28 @@ class VectorStore:
             Словарь со статистикой
         """
         try:
-            results = self.collection.get(where={"user_id": user_id})
+            doc_index = self._get_doc_index(user_id)
             
-            if not results['ids']:
+            if not doc_index:
                 return {
                     'total_chunks': 0,
                     'total_documents': 0,
-                    'documents': []
+                    'documents': [],
+                    'chunk_counts': {}
                 }
             
-            # Подсчитываем уникальные документы
-            document_ids = set()
-            for metadata in results['metadatas']:
-                if 'document_id' in metadata:
-                    document_ids.add(metadata['document_id'])
+            # Число чанков каждого документа берем из индекса документов
+            chunk_counts = {
+                document_id: len(ids)
+                for document_id, ids in doc_index.items()
+                if document_id is not None
+            }
             
             return {
-                'total_chunks': len(results['ids']),
-                'total_documents': len(document_ids),
-                'documents': list(document_ids)
+                'total_chunks': sum(len(ids) for ids in doc_index.values()),
+                'total_documents': len(chunk_counts),
+                'documents': list(chunk_counts),
+                'chunk_counts': chunk_counts
             }
             
         except Exception as e:
@@ -231,5 +597,6 @@ class VectorStore:
             return {
                 'total_chunks': 0,
                 'total_documents': 0,
-                'documents': []
+                'documents': [],
+                'chunk_counts': {}
             }
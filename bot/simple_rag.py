@@ -1,22 +1,36 @@
 """Простая RAG система на основе LangChain (как в naive-rag.ipynb)"""
 
+import asyncio
+import hashlib
+import itertools
+import json
 import logging
+import re
+import time
 import tempfile
+import threading
 import os
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 
 try:
+    import httpx
+    import numpy as np
     from langchain_community.document_loaders import PyPDFLoader
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     from langchain_core.vectorstores import InMemoryVectorStore
     from langchain_openai import OpenAIEmbeddings, ChatOpenAI
     from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
     from langchain_core.output_parsers import StrOutputParser
-    from langchain_core.runnables import RunnablePassthrough
-    from langchain_core.messages import HumanMessage, AIMessage
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+    from langchain_core.documents import Document
+    from langchain_core.document_loaders import Blob
 except ImportError as e:
     logging.warning(f"LangChain не установлен: {e}")
+    httpx = None
+    np = None
     PyPDFLoader = None
     RecursiveCharacterTextSplitter = None
     InMemoryVectorStore = None
@@ -24,13 +38,350 @@ except ImportError as e:
     ChatOpenAI = None
     ChatPromptTemplate = None
     StrOutputParser = None
+    RunnableLambda = None
     RunnablePassthrough = None
     HumanMessage = None
     AIMessage = None
+    SystemMessage = None
     MessagesPlaceholder = None
+    Document = None
+    Blob = None
+
+try:
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+except ImportError:
+    faiss = None
+    InMemoryDocstore = None
+    FAISS = None
+    DistanceStrategy = None
+
+try:
+    from langchain_community.embeddings import InfinityEmbeddingsLocal
+except ImportError:
+    InfinityEmbeddingsLocal = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+from bot.embedding_cache import CachedEmbeddings, EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# Размер чанка и перекрытие соседних чанков в символах: крупные чанки уменьшают
+# число эмбеддингов и размер индекса, не разрывая абзацы посередине
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+# Размер батча текстов в одном запросе к API эмбеддингов
+EMBEDDING_BATCH_SIZE = 96
+
+# Максимум одновременных запросов к API эмбеддингов при обработке документа
+# (ограничение от ошибок rate limit OpenRouter на больших PDF)
+EMBEDDING_MAX_CONCURRENCY = 8
+
+# Модель эмбеддингов OpenAI по умолчанию
+OPENAI_EMBEDDINGS_MODEL = "text-embedding-3-large"
+
+# Локальные эмбеддинги через Infinity включаются переменной окружения USE_LOCAL_EMBEDDINGS=1
+USE_LOCAL_EMBEDDINGS = os.getenv('USE_LOCAL_EMBEDDINGS', '0') == '1'
+LOCAL_EMBEDDINGS_MODEL = os.getenv('LOCAL_EMBEDDINGS_MODEL', 'BAAI/bge-small-en-v1.5')
+LOCAL_EMBEDDINGS_DEVICE = os.getenv('LOCAL_EMBEDDINGS_DEVICE', 'auto')
+LOCAL_EMBEDDINGS_BATCH_SIZE = 64
+
+# Общая локальная модель эмбеддингов (загружается один раз на процесс)
+_local_embeddings = None
+
+# Таймаут запросов к OpenRouter/OpenAI и размер общего пула соединений
+HTTP_TIMEOUT = 60
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+
+# Общие HTTP-клиенты всех экземпляров SimpleRAG: (httpx.Client, httpx.AsyncClient)
+_http_clients = None
+
+# Недавно обработанные PDF: (вид индекса, SHA-256) -> (векторное хранилище, результат).
+# Повторная загрузка того же файла не требует ни разбора, ни чтения индекса с диска
+PROCESSED_PDF_CACHE_SIZE = 4
+_processed_pdfs = OrderedDict()
+
+# Прогрев токенизатора эмбеддингов запускается один раз на процесс
+_warmup_started = False
+
+# Параметры графа HNSW в FAISS: число связей узла и ширина поиска при построении и запросе
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Квантование векторов в индексе FAISS: fp16 (по умолчанию) или int8 - вчетверо
+# меньше float32 и быстрее поиск при небольшой потере точности
+FAISS_QUANTIZER = os.getenv('RAG_FAISS_QUANTIZER', 'fp16')
+
+# Поиск чанков для контекста LLM: MMR из RETRIEVER_FETCH_K ближайших выбирает
+# RETRIEVER_K непохожих друг на друга, чтобы почти одинаковые чанки (повторяющиеся
+# колонтитулы, перекрытия) не занимали место в промпте
+RETRIEVER_K = 3
+RETRIEVER_FETCH_K = 10
+RETRIEVER_LAMBDA_MULT = 0.5
+
+# Для небольших документов граф HNSW не окупает время построения: до этого числа
+# чанков используется плоский индекс с полным перебором
+HNSW_MIN_CHUNKS = 200
+
+# Каталог сохраненных индексов FAISS: подкаталог модели эмбеддингов, ключ - SHA-256 содержимого PDF
+INDEX_CACHE_DIR = Path(os.getenv('RAG_INDEX_CACHE_DIR', str(Path.home() / '.cache' / 'ml_tutor_bot')))
+
+# Дисковый кэш эмбеддингов OpenAI (общий на процесс)
+EMBEDDING_CACHE_PATH = INDEX_CACHE_DIR / 'embeddings.sqlite3'
+_embedding_cache = None
+
+# ArXiv ID в тексте первой страницы: с префиксом arXiv (группа 1) или без него (группа 2)
+_ARXIV_RE = re.compile(r'arxiv:(\d+\.\d+)|(\d{4}\.\d{4,5})', re.IGNORECASE)
+
+# Служебные префиксы ответа RAG системы, которые LLM иногда повторяет в начале строк
+_RAG_PREFIX_RE = re.compile(
+    r'^(?:📄 )?Ответ RAG системы:\s*\n?'
+    r'|^📄 Ответ на основе документа(?: \(частично\))?:\s*\n?',
+    re.MULTILINE
+)
+
+# Те же префиксы буквально: пока потоковый ответ может оказаться их началом,
+# он не показывается пользователю
+_RAG_PREFIXES = (
+    "📄 Ответ RAG системы:",
+    "Ответ RAG системы:",
+    "📄 Ответ на основе документа:",
+    "📄 Ответ на основе документа (частично):",
+)
+
+# Стандартный ответ "не нашел" (в том числе с буквой ё): самое левое совпадение
+# дает начало фразы в ответе
+_NO_ANSWER_RE = re.compile(r'я не наш[её]л|не наш[её]л ответа')
+
+# Паттерны для поиска тем документа
+_TOPIC_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+    for pattern in (
+        r'## (.+)',  # Markdown заголовки
+        r'# (.+)',   # Markdown заголовки
+        r'Abstract[:\s]*(.+)',  # Abstract
+        r'Introduction[:\s]*(.+)',  # Introduction
+        r'Method[:\s]*(.+)',  # Method
+        r'Result[:\s]*(.+)',  # Results
+        r'Conclusion[:\s]*(.+)',  # Conclusion
+    )
+]
+
+# Системный промпт базовой RAG цепочки (как в notebook). Он не меняется между запросами,
+# а контекст идет отдельным сообщением после него, чтобы провайдер мог
+# переиспользовать кэш префикса промпта
+SYSTEM_TEMPLATE = """
+You are an assistant for question-answering tasks.
+Do not use Chinese characters in respond.
+You can understand and analyze content in any language (English, Russian, etc.), but ALWAYS respond in Russian language.
+
+Use the following pieces of retrieved context to answer the user question.
+If you don't know the answer, just say 'Я не нашел ответа на ваш вопрос!'.
+Use three sentences maximum and keep the answer concise.
+"""
+
+# Conversational системный промпт (как в notebook). Контекст меняется на каждый
+# вопрос, поэтому идет после статичного промпта и истории диалога
+CONVERSATION_SYSTEM_TEMPLATE = """
+You are an assistant for question-answering tasks. Do not use Chinese characters in respond. 
+
+You can understand and analyze content in any language (English, Russian, etc.), but ALWAYS respond in Russian language.
+
+Answer the user's questions based on the conversation history and below context retrieved for the last question. Answer 'Я не нашел ответа на ваш вопрос!' if you don't find any information in the context. Use three sentences maximum and keep the answer concise.
+"""
+
+# Инструкция для Query Transformation (как в notebook)
+QUERY_TRANSFORM_TEMPLATE = "Transform last user message to a search query that will best retrieve relevant information from the document. CRITICAL: Detect the document language from the conversation history. If the document content is in English, create an English search query; if in Russian, create a Russian query. For general questions like 'what is this about?' or 'what is the article about?', search for: article topic, main theme, summary, abstract, main concepts, document content. For specific questions, search for exact information. Try to thoroughly analyze all messages to generate the most relevant query. The longer result better than short. Only respond with the query, nothing else."
+
+# Шаблоны промптов не зависят от документа, поэтому создаются один раз на процесс
+if ChatPromptTemplate is not None:
+    _QA_PROMPT = ChatPromptTemplate([
+        ("system", SYSTEM_TEMPLATE),
+        ("system", "Context:\n{context}"),
+        ("human", "{question}"),
+    ])
+    _CONVERSATION_PROMPT = ChatPromptTemplate([
+        ("system", CONVERSATION_SYSTEM_TEMPLATE),
+        ("placeholder", "{messages}"),
+        ("system", "Context retrieved for the last question:\n\n{context}")
+    ])
+    _QUERY_TRANSFORM_PROMPT = ChatPromptTemplate.from_messages([
+        MessagesPlaceholder(variable_name="messages"),
+        ("user", QUERY_TRANSFORM_TEMPLATE),
+    ])
+else:
+    _QA_PROMPT = None
+    _CONVERSATION_PROMPT = None
+    _QUERY_TRANSFORM_PROMPT = None
+
+
+def _format_chunks(chunks) -> str:
+    """Объединяем чанки в одну строку (как в notebook)"""
+    return "\n\n".join(chunk.page_content for chunk in chunks)
+
+
+def _last_message_content(params: Dict) -> str:
+    """Текст последнего сообщения диалога - запрос для поиска чанков (как в notebook)"""
+    return params["messages"][-1].content
+
+
+def _get_http_clients():
+    """
+    Общие sync и async HTTP-клиенты для LLM и эмбеддингов
+    
+    Экземпляр SimpleRAG создается на каждый документ, и без общего пула каждый
+    ChatOpenAI/OpenAIEmbeddings заново открывал бы TLS-соединения. AsyncClient
+    используется в event loop бота. Если установлен пакет h2, клиенты работают
+    по HTTP/2, и параллельные запросы идут по одному соединению
+    """
+    global _http_clients
+    if _http_clients is None:
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+        )
+        http2 = h2 is not None
+        _http_clients = (
+            httpx.Client(timeout=HTTP_TIMEOUT, limits=limits, http2=http2),
+            httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits, http2=http2)
+        )
+    return _http_clients
+
+
+def _warmup_tokenizer(model_name: str) -> None:
+    """Загрузка кодировки tiktoken, которую OpenAIEmbeddings использует при первом запросе"""
+    try:
+        tiktoken.encoding_for_model(model_name)
+        logger.info(f"Токенизатор для {model_name} загружен")
+    except Exception as e:
+        logger.debug(f"Не удалось прогреть токенизатор {model_name}: {e}")
+
+
+def _start_warmup(model_name: str) -> None:
+    """Фоновый прогрев, чтобы первый PDF пользователя не ждал загрузку токенизатора"""
+    global _warmup_started
+    if _warmup_started or tiktoken is None:
+        return
+    
+    _warmup_started = True
+    threading.Thread(
+        target=_warmup_tokenizer,
+        args=(model_name,),
+        name="rag-warmup",
+        daemon=True
+    ).start()
+
+
+def _get_embedding_cache() -> EmbeddingCache:
+    """Общий дисковый кэш эмбеддингов"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
+
+
+def _get_local_embeddings():
+    """Общий экземпляр InfinityEmbeddingsLocal: модель не грузится заново на каждый документ"""
+    global _local_embeddings
+    if _local_embeddings is None:
+        _local_embeddings = InfinityEmbeddingsLocal(
+            model=LOCAL_EMBEDDINGS_MODEL,
+            device=LOCAL_EMBEDDINGS_DEVICE,
+            batch_size=LOCAL_EMBEDDINGS_BATCH_SIZE,
+            model_warmup=True
+        )
+    return _local_embeddings
+
+
+# Слова текста без знаков препинания
+_WORD_RE = re.compile(r'\w+')
+
+# Варианты написания терминов для анализа качества ответа ("беггинг" vs "бэггинг")
+_WORD_VARIATIONS = {
+    'беггинг': frozenset(['бэггинг', 'bagging']),
+    'бэггинг': frozenset(['беггинг', 'bagging']),
+    'bagging': frozenset(['беггинг', 'бэггинг']),
+    'бустинг': frozenset(['boosting']),
+    'boosting': frozenset(['бустинг']),
+    'ансамбль': frozenset(['ensemble']),
+    'ensemble': frozenset(['ансамбль']),
+}
+
+# Граница предложений для умного разбиения на чанки
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Знаки конца предложения для проверки окончания чанка (в том числе полноширинные)
+_SENT_ENDS = ('.', '!', '?', '。', '！', '？')
+
+
+def _iter_sentences(text: str, limit: int):
+    """
+    Предложения текста для разбиения на чанки
+    
+    Предложение длиннее limit (таблицы, списки литературы и другой текст без точек)
+    режется по пробелам на части не длиннее limit, чтобы ни один чанк не выходил
+    за размер и не обрезался моделью эмбеддингов
+    
+    Yields:
+        (позиция начала предложения в text, предложение без пробелов по краям)
+    """
+    position = 0
+    for match in itertools.chain(_SENT_RE.finditer(text), [None]):
+        end = match.start() if match else len(text)
+        sentence = text[position:end].lstrip()
+        start = end - len(sentence)
+        sentence = sentence.rstrip()
+        while len(sentence) > limit:
+            cut = sentence.rfind(' ', 0, limit + 1)
+            if cut <= 0:
+                cut = limit
+            yield start, sentence[:cut]
+            rest = sentence[cut:]
+            sentence = rest.lstrip()
+            start += cut + len(rest) - len(sentence)
+        if sentence:
+            yield start, sentence
+        position = match.end() if match else len(text)
+
+
+# Порог косинусной близости вопросов, при котором возвращается кэшированный ответ
+ANSWER_CACHE_SIMILARITY = 0.97
+
+# Максимальное число ответов в семантическом кэше
+ANSWER_CACHE_SIZE = 512
+
+# Окно истории диалога (число последних сообщений) и бюджет ее токенов: если история
+# длиннее, старые сообщения заменяются кратким пересказом
+HISTORY_WINDOW = 6
+HISTORY_TOKEN_BUDGET = 2048
+
+# Инструкция для пересказа старой части диалога
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize the conversation above in at most three sentences. "
+    "Keep the topics and facts the user asked about. Respond in Russian."
+)
+
+# Размер LRU-кэша эмбеддингов вопросов
+QUESTION_EMBEDDING_CACHE_SIZE = 1024
+
+# Пробелы и завершающая пунктуация не влияют на эмбеддинг вопроса для кэша
+_QUESTION_SPACES_RE = re.compile(r'\s+')
+_QUESTION_TRAILING_PUNCT_RE = re.compile(r'[\s\.\,\!\?\;\:]+$')
+
 
 class SimpleRAG:
     """Простая RAG система на основе LangChain (как в notebook)"""
@@ -44,19 +395,40 @@ class SimpleRAG:
         self.llm = None
         self.llm_query_transform = None
         self.rag_chain = None
+        self.question_answering_prompt = None
         self.rag_conversation_chain = None
         self.rag_query_transform_chain = None
+        self.context_retriever = None
+        # Семантический кэш ответов: кольцевой буфер эмбеддингов вопросов
+        # (ANSWER_CACHE_SIZE x dim) и соответствующие ответы
+        self._answer_cache_vectors = None
+        self._answer_cache_results = []
+        # Позиция следующей записи в кольцевом буфере
+        self._answer_cache_next = 0
+        # Кэш эмбеддингов вопросов: нормализованный текст -> эмбеддинг
+        self._question_embedding_cache = OrderedDict()
+        # Темы документа: (векторное хранилище, список тем)
+        self._topics_cache = None
+        # Множества слов чанков текущего документа для анализа качества ответа:
+        # текст чанка -> frozenset слов в нижнем регистре. Строятся один раз при загрузке
+        # документа и не попадают в метаданные чанков и сохраненный индекс FAISS
+        self._chunk_word_sets = {}
         self._initialize_components()
     
     def _initialize_components(self):
         """Инициализация компонентов RAG"""
         try:
+            # Все клиенты переиспользуют общий пул HTTP-соединений
+            http_client, http_async_client = _get_http_clients()
+            
             # Инициализируем основной LLM (используем OpenRouter вместо OpenAI)
             self.llm = ChatOpenAI(
                 model="meta-llama/llama-3.3-70b-instruct:free", 
                 temperature=0.9,
                 openai_api_base="https://openrouter.ai/api/v1",
-                openai_api_key=os.getenv("OPENROUTER_API_KEY")
+                openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+                http_client=http_client,
+                http_async_client=http_async_client
             )
             
             # Инициализируем LLM для Query Transformation (как в notebook)
@@ -64,12 +436,32 @@ class SimpleRAG:
                 model="meta-llama/llama-3.3-70b-instruct:free",
                 temperature=0.4,
                 openai_api_base="https://openrouter.ai/api/v1",
-                openai_api_key=os.getenv("OPENROUTER_API_KEY")
+                openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+                http_client=http_client,
+                http_async_client=http_async_client
             )
             
-            # Инициализируем эмбеддинги (как в notebook)
-            logger.info("Используем OpenAI API для embeddings (как в notebook)")
-            self.embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+            # Инициализируем эмбеддинги: локальная модель Infinity или OpenAI API (как в notebook)
+            if USE_LOCAL_EMBEDDINGS and InfinityEmbeddingsLocal is not None:
+                logger.info(f"Используем локальные embeddings Infinity: {LOCAL_EMBEDDINGS_MODEL}")
+                self.embeddings = _get_local_embeddings()
+                self.embeddings_model_name = LOCAL_EMBEDDINGS_MODEL
+            else:
+                if USE_LOCAL_EMBEDDINGS:
+                    logger.warning("infinity_emb не установлен, используем OpenAI API для embeddings")
+                logger.info("Используем OpenAI API для embeddings (как в notebook)")
+                # Эмбеддинги API платные и медленные, поэтому кэшируются на диске
+                self.embeddings = CachedEmbeddings(
+                    OpenAIEmbeddings(
+                        model=OPENAI_EMBEDDINGS_MODEL,
+                        http_client=http_client,
+                        http_async_client=http_async_client
+                    ),
+                    OPENAI_EMBEDDINGS_MODEL,
+                    _get_embedding_cache()
+                )
+                self.embeddings_model_name = OPENAI_EMBEDDINGS_MODEL
+                _start_warmup(OPENAI_EMBEDDINGS_MODEL)
             
             logger.info("RAG компоненты инициализированы с OpenRouter")
             
@@ -77,7 +469,18 @@ class SimpleRAG:
             logger.error(f"Ошибка инициализации RAG: {e}")
             raise
     
-    def process_pdf(self, file_path: str) -> Dict[str, Any]:
+    async def aensure_embeddings_started(self) -> None:
+        """
+        Запуск фонового движка локальных эмбеддингов Infinity
+        
+        Движок стартует один раз и работает до завершения процесса, иначе
+        InfinityEmbeddingsLocal поднимал бы и останавливал его на каждый запрос
+        """
+        engine = getattr(self.embeddings, 'engine', None)
+        if engine is not None and not engine.running:
+            await self.embeddings.__aenter__()
+    
+    async def aprocess_pdf(self, file_path: str) -> Dict[str, Any]:
         """
         Обработка PDF файла (как в notebook)
         
@@ -90,6 +493,21 @@ class SimpleRAG:
         try:
             logger.info(f"Обрабатываю PDF: {file_path}")
             
+            await self.aensure_embeddings_started()
+            
+            # Файл читается в память один раз: для хеша и для разбора страниц pypdf,
+            # который делает много мелких seek/read и быстрее работает с BytesIO, чем с диском
+            pdf_data = Path(file_path).read_bytes()
+            
+            # Множества слов прежнего документа больше не понадобятся
+            self._chunk_word_sets = {}
+            
+            # Тот же PDF уже обрабатывался - поднимаем сохраненный индекс без повторных эмбеддингов
+            file_hash = hashlib.sha256(pdf_data).hexdigest()
+            cached_result = self._restore_processed_pdf(file_hash, file_path)
+            if cached_result is not None:
+                return cached_result
+            
             # 1. Загрузка документа (как в notebook)
             loader = PyPDFLoader(
                 file_path=file_path,
@@ -97,54 +515,63 @@ class SimpleRAG:
                 extraction_mode="plain"
             )
             
-            # Загружаем страницы
-            pages = []
-            for page in loader.load():
-                pages.append(page)
+            # Разбор PDF занимает CPU на секунды, поэтому идет в отдельном потоке
+            # и не блокирует event loop бота для остальных пользователей
+            first_pages, full_document, page_count = await asyncio.to_thread(
+                self._read_pdf_pages, loader, pdf_data, file_path
+            )
+            del pdf_data
             
-            logger.info(f"Загружено {len(pages)} страниц")
+            logger.info(f"Загружено {page_count} страниц")
             
-            # 2. Разбиение на чанки с улучшенной логикой
-            all_splits = self._smart_chunk_split(pages, chunk_size=400, overlap=100)
+            # 2. Разбиение на чанки с улучшенной логикой (тоже CPU, поэтому в отдельном потоке)
+            all_splits = await asyncio.to_thread(
+                self._smart_chunk_split, [full_document], CHUNK_SIZE, CHUNK_OVERLAP
+            )
             
             logger.info(f"Создано {len(all_splits)} чанков")
             
-            # Анализируем качество разбиения на чанки
-            self._analyze_chunks_quality(pages, all_splits)
-            
             # 3. Создание векторного хранилища (как в notebook)
             logger.info("Создаю векторное хранилище...")
             
-            # Создаем векторное хранилище (как в notebook)
-            self.vector_store = InMemoryVectorStore.from_documents(
-                all_splits,
-                embedding=self.embeddings
+            # Создаем векторное хранилище, эмбеддинги батчей запрашиваются параллельно.
+            # Пока ждем ответов API эмбеддингов, в отдельных потоках анализируем
+            # качество разбиения на чанки и строим множества слов чанков
+            started = time.perf_counter()
+            _, self._chunk_word_sets, self.vector_store = await asyncio.gather(
+                asyncio.to_thread(self._analyze_chunks_quality, [full_document], all_splits),
+                asyncio.to_thread(self._build_chunk_word_sets, all_splits),
+                self._abuild_vector_store(all_splits)
             )
-            logger.info(f"Векторное хранилище создано с {len(all_splits)} чанками")
-            for i, chunk in enumerate(all_splits):
-                logger.info(f"Чанк {i+1} при создании: {chunk.page_content[:150]}...")
+            self._clear_answer_cache()
+            logger.info(f"Векторное хранилище создано с {len(all_splits)} чанками за {time.perf_counter() - started:.2f} с")
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, chunk in enumerate(all_splits):
+                    logger.debug(f"Чанк {i+1} при создании: {chunk.page_content[:150]}...")
             
             # 4. Создание retriever (как в notebook)
-            self.retriever = self.vector_store.as_retriever(
-                search_kwargs={'k': 3}
-            )
+            self.retriever = self._create_retriever()
             
             # 5. Создание всех RAG цепочек (как в notebook)
             self._create_rag_chains()
             
             # Создаем превью контента
-            content_preview = self._create_content_preview(pages)
+            content_preview = self._create_content_preview(first_pages)
             
             # Извлекаем метаданные
-            metadata = self._extract_metadata(file_path, pages)
+            metadata = self._extract_metadata(file_path, first_pages, page_count)
             
-            return {
+            result = {
                 'success': True,
-                'pages': len(pages),
+                'pages': page_count,
                 'chunks_count': len(all_splits),
                 'content_preview': content_preview,
                 'metadata': metadata
             }
+            self._save_cached_index(file_hash, result)
+            self._remember_processed_pdf(file_hash, result)
+            
+            return result
             
         except Exception as e:
             logger.error(f"Ошибка обработки PDF: {e}")
@@ -153,9 +580,213 @@ class SimpleRAG:
                 'error': f'Ошибка обработки: {str(e)}'
             }
     
+    def _index_kind(self) -> str:
+        """Вид индекса: индексы разных моделей и настроек разбиения не смешиваются"""
+        return f"{self.embeddings_model_name.replace('/', '__')}_{CHUNK_SIZE}_{CHUNK_OVERLAP}_{FAISS_QUANTIZER}"
+    
+    def _index_cache_path(self, file_hash: str) -> Path:
+        """Каталог сохраненного индекса"""
+        return INDEX_CACHE_DIR / self._index_kind() / file_hash
+    
+    def _restore_processed_pdf(self, file_hash: str, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Восстановление уже обработанного PDF из памяти или с диска
+        
+        Args:
+            file_hash: SHA-256 содержимого PDF
+            file_path: Путь к PDF файлу
+            
+        Returns:
+            Результат обработки или None, если PDF обрабатывается впервые
+        """
+        key = (self._index_kind(), file_hash)
+        cached = _processed_pdfs.get(key)
+        if cached is not None:
+            _processed_pdfs.move_to_end(key)
+            vector_store, result = cached
+            logger.info(f"PDF {file_hash[:12]} уже обработан, используем готовое векторное хранилище")
+        else:
+            cached = self._load_cached_index(file_hash)
+            if cached is None:
+                return None
+            vector_store, result = cached
+        
+        self.vector_store = vector_store
+        self._clear_answer_cache()
+        self.retriever = self._create_retriever()
+        self._create_rag_chains()
+        self._remember_processed_pdf(file_hash, result)
+        
+        # Имя файла при повторной загрузке может отличаться
+        return {**result, 'metadata': {**result['metadata'], 'title': Path(file_path).stem}}
+    
+    def _remember_processed_pdf(self, file_hash: str, result: Dict[str, Any]) -> None:
+        """Сохранение векторного хранилища обработанного PDF в LRU-кэш процесса"""
+        key = (self._index_kind(), file_hash)
+        _processed_pdfs[key] = (self.vector_store, result)
+        _processed_pdfs.move_to_end(key)
+        if len(_processed_pdfs) > PROCESSED_PDF_CACHE_SIZE:
+            _processed_pdfs.popitem(last=False)
+    
+    def _read_pdf_pages(self, loader, pdf_data: bytes, file_path: str):
+        """
+        Чтение страниц PDF за один проход
+        
+        Первые страницы сохраняются для превью и метаданных, текст остальных
+        сразу склеивается в общий документ
+        
+        Returns:
+            (первые страницы, документ с полным текстом, число страниц)
+        """
+        first_pages = []
+        page_texts = []
+        for page in loader.parser.lazy_parse(Blob.from_data(pdf_data, path=file_path)):
+            if len(first_pages) < 3:
+                first_pages.append(page)
+            page_texts.append(page.page_content)
+        
+        full_document = Document(
+            page_content="\n".join(page_texts),
+            metadata={"source": file_path}
+        )
+        return first_pages, full_document, len(page_texts)
+    
+    def _load_cached_index(self, file_hash: str):
+        """
+        Загрузка сохраненного индекса FAISS для PDF с тем же содержимым
+        
+        Args:
+            file_hash: SHA-256 содержимого PDF
+            
+        Returns:
+            (векторное хранилище, результат обработки) или None, если индекса нет
+        """
+        cache_path = self._index_cache_path(file_hash)
+        if FAISS is None or not (cache_path / 'index.faiss').exists():
+            return None
+        
+        try:
+            # Pickle docstore пишет только сам бот в локальный каталог кэша
+            vector_store = FAISS.load_local(
+                str(cache_path),
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+            with open(cache_path / 'result.json', encoding='utf-8') as f:
+                result = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить сохраненный индекс {cache_path}: {e}")
+            return None
+        
+        logger.info(f"Загружен сохраненный индекс для PDF {file_hash[:12]}: {result['chunks_count']} чанков")
+        return vector_store, result
+    
+    def _save_cached_index(self, file_hash: str, result: Dict[str, Any]) -> None:
+        """Сохранение индекса FAISS и результата обработки PDF на диск"""
+        if FAISS is None or not isinstance(self.vector_store, FAISS):
+            return
+        
+        cache_path = self._index_cache_path(file_hash)
+        try:
+            self.vector_store.save_local(str(cache_path))
+            with open(cache_path / 'result.json', 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить индекс {cache_path}: {e}")
+    
+    async def _abuild_vector_store(self, documents: List):
+        """
+        Создание векторного хранилища с параллельным получением эмбеддингов
+        
+        Чанки делятся на батчи по EMBEDDING_BATCH_SIZE, и запросы к API эмбеддингов
+        для батчей выполняются одновременно (не больше EMBEDDING_MAX_CONCURRENCY)
+        вместо последовательных round-trip.
+        Если установлен FAISS, поиск идет по графу HNSW, иначе линейным перебором
+        в InMemoryVectorStore
+        
+        Args:
+            documents: Список чанков
+            
+        Returns:
+            Заполненное векторное хранилище
+        """
+        batches = [
+            documents[i:i + EMBEDDING_BATCH_SIZE]
+            for i in range(0, len(documents), EMBEDDING_BATCH_SIZE)
+        ]
+        
+        semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+        
+        if FAISS is None or not documents:
+            vector_store = InMemoryVectorStore(embedding=self.embeddings)
+            await asyncio.gather(*(limited(vector_store.aadd_documents(batch)) for batch in batches))
+            return vector_store
+        
+        batch_embeddings = await asyncio.gather(*(
+            limited(self.embeddings.aembed_documents([doc.page_content for doc in batch]))
+            for batch in batches
+        ))
+        embeddings = [vector for batch in batch_embeddings for vector in batch]
+        return self._build_hnsw_store(documents, embeddings)
+    
+    def _build_hnsw_store(self, documents: List, embeddings: List[List[float]]):
+        """
+        Векторное хранилище FAISS с индексом HNSW по готовым эмбеддингам
+        
+        Эмбеддинги text-embedding-3-large нормализованы, поэтому используется
+        скалярное произведение (оно совпадает с косинусной близостью). Векторы
+        хранятся в float16 (или int8, см. FAISS_QUANTIZER): меньше памяти и трафика
+        при расчете близости. Документы меньше HNSW_MIN_CHUNKS чанков получают
+        плоский индекс
+        """
+        quantizer = (
+            faiss.ScalarQuantizer.QT_8bit if FAISS_QUANTIZER == 'int8'
+            else faiss.ScalarQuantizer.QT_fp16
+        )
+        if len(embeddings) < HNSW_MIN_CHUNKS:
+            index = faiss.IndexScalarQuantizer(
+                len(embeddings[0]),
+                quantizer,
+                faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            index = faiss.IndexHNSWSQ(
+                len(embeddings[0]),
+                quantizer,
+                HNSW_M,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        if not index.is_trained:
+            index.train(np.asarray(embeddings, dtype=np.float32))
+        
+        vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        vector_store.add_embeddings(
+            zip([doc.page_content for doc in documents], embeddings),
+            metadatas=[doc.metadata for doc in documents]
+        )
+        return vector_store
+    
     def _create_rag_chains(self):
         """Создание всех RAG цепочек (как в notebook)"""
         try:
+            # Поиск чанков и склейка контекста одним шагом цепочки
+            self.context_retriever = RunnableLambda(
+                self._retrieve_context,
+                afunc=self._aretrieve_context
+            )
+            
             # 1. Базовая RAG цепочка (как в notebook)
             self._create_basic_rag_chain()
             
@@ -173,35 +804,45 @@ class SimpleRAG:
     
     def format_chunks(self, chunks):
         """Объединяем чанки в одну строку (как в notebook)"""
-        return "\n\n".join(chunk.page_content for chunk in chunks)
+        return _format_chunks(chunks)
+    
+    def _create_retriever(self):
+        """Retriever векторного хранилища с поиском MMR"""
+        return self.vector_store.as_retriever(
+            search_type="mmr",
+            search_kwargs={'k': RETRIEVER_K, 'fetch_k': RETRIEVER_FETCH_K, 'lambda_mult': RETRIEVER_LAMBDA_MULT}
+        )
+    
+    def _search_chunks(self, query: str) -> List:
+        """Поиск чанков (MMR) сразу по векторному хранилищу, минуя retriever"""
+        return self.vector_store.max_marginal_relevance_search(
+            query, k=RETRIEVER_K, fetch_k=RETRIEVER_FETCH_K, lambda_mult=RETRIEVER_LAMBDA_MULT
+        )
+    
+    async def _asearch_chunks(self, query: str) -> List:
+        """Асинхронная версия _search_chunks"""
+        return await self.vector_store.amax_marginal_relevance_search(
+            query, k=RETRIEVER_K, fetch_k=RETRIEVER_FETCH_K, lambda_mult=RETRIEVER_LAMBDA_MULT
+        )
+    
+    def _retrieve_context(self, query: str) -> str:
+        """Контекст для LLM: найденные чанки, склеенные в одну строку"""
+        return self.format_chunks(self._search_chunks(query))
+    
+    async def _aretrieve_context(self, query: str) -> str:
+        """Асинхронная версия _retrieve_context"""
+        return self.format_chunks(await self._asearch_chunks(query))
     
     def _create_basic_rag_chain(self):
         """Создание базовой RAG цепочки (как в notebook)"""
         try:
-            # Системный промпт (как в notebook)
-            SYSTEM_TEMPLATE = """
-You are an assistant for question-answering tasks.
-Do not use Chinese characters in respond.
-You can understand and analyze content in any language (English, Russian, etc.), but ALWAYS respond in Russian language.
-
-Use the following pieces of retrieved context to answer the user question.
-If you don't know the answer, just say 'Я не нашел ответа на ваш вопрос!'.
-Use three sentences maximum and keep the answer concise.
-
-Context:
-{context}
-"""
-            
-            # Создаем промпт шаблон (как в notebook)
-            question_answering_prompt = ChatPromptTemplate([
-                ("system", SYSTEM_TEMPLATE),
-                ("human", "{question}"),
-            ])
+            # Промпт шаблон общий для всех документов
+            self.question_answering_prompt = _QA_PROMPT
             
             # Создаем RAG цепочку (как в notebook)
             self.rag_chain = (
-                {"context": self.retriever | self.format_chunks, "question": RunnablePassthrough()}
-                | question_answering_prompt
+                {"context": self.context_retriever, "question": RunnablePassthrough()}
+                | self.question_answering_prompt
                 | self.llm
                 | StrOutputParser()
             )
@@ -215,35 +856,12 @@ Context:
     def _create_conversational_rag_chain(self):
         """Создание conversational RAG цепочки (как в notebook)"""
         try:
-            # Conversational системный промпт (как в notebook)
-            CONVERSATION_SYSTEM_TEMPLATE = """
-You are an assistant for question-answering tasks. Do not use Chinese characters in respond. 
-
-You can understand and analyze content in any language (English, Russian, etc.), but ALWAYS respond in Russian language.
-
-Answer the user's questions based on the conversation history and below context retrieved for the last question. Answer 'Я не нашел ответа на ваш вопрос!' if you don't find any information in the context. Use three sentences maximum and keep the answer concise.
-
-Context retrieved for the last question:
-
-{context}
-"""
-            
-            # Создаем conversational промпт (как в notebook)
-            conversational_answering_prompt = ChatPromptTemplate([
-                ("system", CONVERSATION_SYSTEM_TEMPLATE),
-                ("placeholder", "{messages}")
-            ])
-            
-            # Функция для получения последнего сообщения (как в notebook)
-            def get_last_message_for_retriever_input(params: Dict):
-                return params["messages"][-1].content
-            
             # Создаем conversational RAG цепочку (как в notebook)
             self.rag_conversation_chain = (
                 RunnablePassthrough.assign(
-                    context=get_last_message_for_retriever_input | self.retriever | self.format_chunks
+                    context=RunnableLambda(_last_message_content) | self.context_retriever
                 )
-                | conversational_answering_prompt
+                | _CONVERSATION_PROMPT
                 | self.llm
                 | StrOutputParser()
             )
@@ -257,48 +875,26 @@ Context retrieved for the last question:
     def _create_query_transform_rag_chain(self):
         """Создание RAG цепочки с Query Transformation (как в notebook)"""
         try:
-            # Промпт для Query Transformation (как в notebook)
-            retrieval_query_transform_prompt = ChatPromptTemplate.from_messages([
-                MessagesPlaceholder(variable_name="messages"),
-                (
-                    "user",
-                    "Transform last user message to a search query that will best retrieve relevant information from the document. CRITICAL: Detect the document language from the conversation history. If the document content is in English, create an English search query; if in Russian, create a Russian query. For general questions like 'what is this about?' or 'what is the article about?', search for: article topic, main theme, summary, abstract, main concepts, document content. For specific questions, search for exact information. Try to thoroughly analyze all messages to generate the most relevant query. The longer result better than short. Only respond with the query, nothing else.",
-                ),
-            ])
-            
             # Создаем цепочку Query Transformation (как в notebook)
             retrieval_query_transformation_chain = (
-                retrieval_query_transform_prompt 
+                _QUERY_TRANSFORM_PROMPT
                 | self.llm_query_transform 
                 | StrOutputParser()
             )
             
-            # Conversational промпт для ответов
-            CONVERSATION_SYSTEM_TEMPLATE = """
-You are an assistant for question-answering tasks. Do not use Chinese characters in respond. 
-
-You can understand and analyze content in any language (English, Russian, etc.), but ALWAYS respond in Russian language.
-
-Answer the user's questions based on the conversation history and below context retrieved for the last question. Answer 'Я не нашел ответа на ваш вопрос!' if you don't find any information in the context. Use three sentences maximum and keep the answer concise.
-
-Context retrieved for the last question:
-
-{context}
-"""
-            
-            conversational_answering_prompt = ChatPromptTemplate([
-                ("system", CONVERSATION_SYSTEM_TEMPLATE),
-                ("placeholder", "{messages}")
-            ])
-            
-            # Создаем RAG цепочку с Query Transformation (как в notebook)
+            # Создаем RAG цепочку с Query Transformation (как в notebook). Найденные
+            # чанки возвращаются вместе с ответом, чтобы не искать их повторно для анализа качества
             self.rag_query_transform_chain = (
                 RunnablePassthrough.assign(
-                    context=retrieval_query_transformation_chain | self.retriever | self.format_chunks
+                    chunks=retrieval_query_transformation_chain | RunnableLambda(
+                        self._search_chunks,
+                        afunc=self._asearch_chunks
+                    )
+                )
+                | RunnablePassthrough.assign(context=lambda params: _format_chunks(params["chunks"]))
+                | RunnablePassthrough.assign(
+                    answer=_CONVERSATION_PROMPT | self.llm | StrOutputParser()
                 )
-                | conversational_answering_prompt
-                | self.llm
-                | StrOutputParser()
             )
             
             logger.info("RAG цепочка с Query Transformation создана")
@@ -315,18 +911,36 @@ Context retrieved for the last question:
                 return
             
             # Получаем полный текст
-            full_text = ""
-            for page in pages:
-                full_text += page.page_content + "\n"
+            full_text = "".join(page.page_content + "\n" for page in pages)
+            
+            # Границы каждого чанка в исходном тексте для детального анализа и проверки
+            # покрытия: _smart_chunk_split сохраняет их в метаданных, для остальных
+            # чанков начало ищется по первым 50 символам
+            spans = []
+            for chunk in chunks:
+                if 'start' in chunk.metadata:
+                    spans.append((chunk.metadata['start'], chunk.metadata['end']))
+                else:
+                    start_pos = full_text.find(chunk.page_content[:50])
+                    spans.append((start_pos, start_pos + len(chunk.page_content) if start_pos != -1 else -1))
             
             logger.info("=" * 80)
             logger.info("АНАЛИЗ КАЧЕСТВА РАЗБИЕНИЯ НА ЧАНКИ")
             logger.info("=" * 80)
             
+            # Размеры чанков и признак корректного окончания собираем за один проход,
+            # статистика по ним считается в NumPy
+            chunk_sizes = np.fromiter((len(chunk.page_content) for chunk in chunks), dtype=np.int64, count=len(chunks))
+            ends_correctly = np.fromiter(
+                (chunk.page_content.endswith(_SENT_ENDS) for chunk in chunks),
+                dtype=bool,
+                count=len(chunks)
+            )
+            
             # Основная статистика
             total_text_length = len(full_text)
             total_chunks = len(chunks)
-            total_chunk_length = sum(len(chunk.page_content) for chunk in chunks)
+            total_chunk_length = int(chunk_sizes.sum())
             
             logger.info(f"📊 ОБЩАЯ СТАТИСТИКА:")
             logger.info(f"   • Длина исходного текста: {total_text_length:,} символов")
@@ -335,48 +949,43 @@ Context retrieved for the last question:
             logger.info(f"   • Покрытие текста: {(total_chunk_length/total_text_length)*100:.1f}%")
             
             # Анализ размеров чанков
-            chunk_sizes = [len(chunk.page_content) for chunk in chunks]
-            avg_size = sum(chunk_sizes) / len(chunk_sizes)
-            min_size = min(chunk_sizes)
-            max_size = max(chunk_sizes)
+            avg_size = float(chunk_sizes.mean())
+            min_size = int(chunk_sizes.min())
+            max_size = int(chunk_sizes.max())
             
             logger.info(f"📏 РАЗМЕРЫ ЧАНКОВ:")
             logger.info(f"   • Средний размер: {avg_size:.0f} символов")
             logger.info(f"   • Минимальный размер: {min_size} символов")
             logger.info(f"   • Максимальный размер: {max_size} символов")
             
-            # Детальный анализ каждого чанка
-            logger.info(f"📝 ДЕТАЛЬНЫЙ АНАЛИЗ ЧАНКОВ:")
-            for i, chunk in enumerate(chunks):
-                chunk_text = chunk.page_content
-                chunk_length = len(chunk_text)
-                
-                # Находим начало и конец чанка в исходном тексте
-                start_pos = full_text.find(chunk_text[:50])  # Ищем по первым 50 символам
-                end_pos = start_pos + chunk_length if start_pos != -1 else -1
-                
-                logger.info(f"   Чанк {i+1:2d}: {chunk_length:3d} символов | Позиция: {start_pos:4d}-{end_pos:4d}")
-                logger.info(f"              Начало: {chunk_text[:60]}...")
-                logger.info(f"              Конец:   ...{chunk_text[-40:]}")
-                
-                # Проверяем, не обрывается ли чанк на середине предложения
-                if chunk_text and chunk_text[-1] not in '.!?':
-                    logger.warning(f"              ⚠️  Чанк {i+1} обрывается на середине предложения!")
-                else:
-                    logger.info(f"              ✅ Чанк {i+1} заканчивается корректно")
+            # Детальный анализ каждого чанка: только в отладочном режиме, иначе на больших
+            # PDF это тысячи отформатированных строк лога, которые никто не увидит
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📝 ДЕТАЛЬНЫЙ АНАЛИЗ ЧАНКОВ:")
+                for i, (chunk, (start_pos, end_pos)) in enumerate(zip(chunks, spans)):
+                    chunk_text = chunk.page_content
+                    chunk_length = len(chunk_text)
+                    
+                    logger.debug(f"   Чанк {i+1:2d}: {chunk_length:3d} символов | Позиция: {start_pos:4d}-{end_pos:4d}")
+                    logger.debug(f"              Начало: {chunk_text[:60]}...")
+                    logger.debug(f"              Конец:   ...{chunk_text[-40:]}")
+                    
+                    # Проверяем, не обрывается ли чанк на середине предложения
+                    if chunk_text and not ends_correctly[i]:
+                        logger.debug(f"              ⚠️  Чанк {i+1} обрывается на середине предложения!")
+                    else:
+                        logger.debug(f"              ✅ Чанк {i+1} заканчивается корректно")
             
             # Проверяем пропуски в тексте
             logger.info(f"🔍 ПРОВЕРКА ПОКРЫТИЯ:")
-            covered_positions = set()
-            for chunk in chunks:
-                chunk_text = chunk.page_content
-                start_pos = full_text.find(chunk_text[:50])
+            # Покрытые позиции отмечаются в булевой маске срезами, без множества из всех позиций
+            covered_mask = np.zeros(len(full_text), dtype=bool)
+            for start_pos, end_pos in spans:
                 if start_pos != -1:
-                    for pos in range(start_pos, start_pos + len(chunk_text)):
-                        covered_positions.add(pos)
+                    covered_mask[start_pos:end_pos] = True
             
             total_positions = len(full_text)
-            covered_count = len(covered_positions)
+            covered_count = int(covered_mask.sum())
             coverage_percent = (covered_count / total_positions) * 100
             
             logger.info(f"   • Покрыто позиций: {covered_count:,} из {total_positions:,}")
@@ -387,7 +996,8 @@ Context retrieved for the last question:
             
             # Общая оценка качества разбиения
             logger.info(f"📈 ОБЩАЯ ОЦЕНКА КАЧЕСТВА:")
-            broken_chunks = sum(1 for chunk in chunks if chunk.page_content and chunk.page_content[-1] not in '.!?')
+            # Пустые чанки не считаются оборванными
+            broken_chunks = int(np.count_nonzero(~ends_correctly & (chunk_sizes > 0)))
             quality_score = ((len(chunks) - broken_chunks) / len(chunks)) * 100 if chunks else 0
             
             logger.info(f"   • Чанков с корректным окончанием: {len(chunks) - broken_chunks}/{len(chunks)}")
@@ -405,56 +1015,79 @@ Context retrieved for the last question:
         except Exception as e:
             logger.error(f"Ошибка анализа качества чанков: {e}")
     
-    def _smart_chunk_split(self, pages: List, chunk_size: int = 400, overlap: int = 100) -> List:
+    def _build_chunk_word_sets(self, chunks: List) -> Dict[str, frozenset]:
+        """Множества слов всех чанков документа (считаются один раз при загрузке)"""
+        return {
+            chunk.page_content: frozenset(_WORD_RE.findall(chunk.page_content.lower()))
+            for chunk in chunks
+        }
+    
+    def _chunk_words(self, chunks: List) -> frozenset:
+        """
+        Точное множество слов найденных чанков в нижнем регистре
+        
+        Берется из множеств, построенных при загрузке документа; для чанков
+        восстановленного из кэша индекса множество строится при первом обращении
+        """
+        word_sets = []
+        for chunk in chunks:
+            words = self._chunk_word_sets.get(chunk.page_content)
+            if words is None:
+                words = frozenset(_WORD_RE.findall(chunk.page_content.lower()))
+                self._chunk_word_sets[chunk.page_content] = words
+            word_sets.append(words)
+        return frozenset().union(*word_sets)
+    
+    def _smart_chunk_split(self, pages: List, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List:
         """Умное разбиение текста на чанки с учетом границ предложений"""
         try:
-            from langchain_core.documents import Document
-            
             # Объединяем весь текст
-            full_text = ""
-            for page in pages:
-                full_text += page.page_content + "\n"
+            full_text = "".join(page.page_content + "\n" for page in pages)
             
-            # Разбиваем на предложения
-            import re
-            sentences = re.split(r'(?<=[.!?])\s+', full_text)
+            # Разбиваем на предложения (слишком длинные - на части)
+            sentences = list(_iter_sentences(full_text, chunk_size))
             
             chunks = []
-            current_chunk = ""
+            # Предложения текущего чанка склеиваются только при его сохранении,
+            # размер с учетом пробелов между ними считается по ходу. Границы чанка
+            # в исходном тексте (start, end) сохраняются в метаданных
+            buffer = []
             current_size = 0
+            chunk_start = chunk_end = 0
             
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if not sentence:
-                    continue
-                
+            for start, sentence in sentences:
                 # Если добавление предложения превысит размер чанка
-                if current_size + len(sentence) > chunk_size and current_chunk:
+                if current_size + len(sentence) > chunk_size and buffer:
                     # Сохраняем текущий чанк
+                    current_chunk = " ".join(buffer)
                     chunks.append(Document(
                         page_content=current_chunk.strip(),
-                        metadata={"source": "smart_split"}
+                        metadata={"source": "smart_split", "start": chunk_start, "end": chunk_end}
                     ))
                     
-                    # Начинаем новый чанк с перекрытием
+                    # Начинаем новый чанк с перекрытием (его начало в тексте - приблизительно)
                     overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
-                    current_chunk = overlap_text + " " + sentence
-                    current_size = len(current_chunk)
+                    buffer = [overlap_text, sentence]
+                    current_size = len(overlap_text) + 1 + len(sentence)
+                    chunk_start = max(chunk_start, chunk_end - len(overlap_text))
                 else:
                     # Добавляем предложение к текущему чанку
-                    if current_chunk:
-                        current_chunk += " " + sentence
-                    else:
-                        current_chunk = sentence
-                    current_size = len(current_chunk)
+                    if not buffer:
+                        chunk_start = start
+                    current_size += len(sentence) + 1 if buffer else len(sentence)
+                    buffer.append(sentence)
+                chunk_end = start + len(sentence)
             
             # Добавляем последний чанк
+            current_chunk = " ".join(buffer)
             if current_chunk.strip():
                 chunks.append(Document(
                     page_content=current_chunk.strip(),
-                    metadata={"source": "smart_split"}
+                    metadata={"source": "smart_split", "start": chunk_start, "end": chunk_end}
                 ))
             
+            chunks = self._drop_duplicate_chunks(chunks)
+            
             logger.info(f"Умное разбиение: создано {len(chunks)} чанков из {len(sentences)} предложений")
             return chunks
             
@@ -468,16 +1101,42 @@ Context retrieved for the last question:
             )
             return text_splitter.split_documents(pages)
     
-    def _create_content_preview(self, pages: List, length: int = 20000) -> str:
-        """Создание превью контента"""
+    def _drop_duplicate_chunks(self, chunks: List) -> List:
+        """
+        Удаление повторяющихся чанков
+        
+        Повторяющиеся колонтитулы и короткие предложения с перекрытием дают чанки
+        с одинаковым текстом: они не добавляют контекста, но занимают место в индексе
+        и в выдаче поиска. Текст сравнивается без учета регистра и пробелов
+        """
+        seen = set()
+        unique = []
+        for chunk in chunks:
+            normalized = " ".join(chunk.page_content.lower().split())
+            digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            unique.append(chunk)
+        
+        if len(unique) < len(chunks):
+            logger.info(f"Удалено {len(chunks) - len(unique)} повторяющихся чанков")
+        return unique
+    
+    def _create_content_preview(self, pages, length: int = 20000) -> str:
+        """Создание превью контента (pages - список или итератор страниц)"""
         try:
-            if not pages:
+            # Берем текст с первых страниц, пока его не наберется с запасом на обрезку
+            parts = []
+            total = 0
+            for page in itertools.islice(pages, 3):  # Первые 3 страницы
+                parts.append(page.page_content)
+                total += len(page.page_content) + 1
+                if total > length * 2:
+                    break
+            if not parts:
                 return ""
-            
-            # Берем текст с первых страниц
-            content = ""
-            for page in pages[:3]:  # Первые 3 страницы
-                content += page.page_content + "\n"
+            content = "\n".join(parts)
             
             if len(content) <= length:
                 return content.strip()
@@ -485,9 +1144,9 @@ Context retrieved for the last question:
             # Обрезаем до нужной длины
             preview = content[:length].strip()
             
-            # Пытаемся закончить на полном предложении
-            last_period = preview.rfind('.')
-            if last_period > length * 0.7:
+            # Пытаемся закончить на полном предложении: точку ищем только в последних 30%
+            last_period = preview.rfind('.', int(length * 0.7) + 1)
+            if last_period != -1:
                 preview = preview[:last_period + 1]
             
             return preview + "..."
@@ -496,12 +1155,15 @@ Context retrieved for the last question:
             logger.error(f"Ошибка создания превью: {e}")
             return "Не удалось создать превью"
     
-    def _extract_metadata(self, file_path: str, pages: List) -> Dict[str, Any]:
-        """Извлечение метаданных"""
+    def _extract_metadata(self, file_path: str, pages: List, page_count: Optional[int] = None) -> Dict[str, Any]:
+        """Извлечение метаданных (pages могут содержать только первые страницы документа)"""
+        if page_count is None:
+            page_count = len(pages) if pages else 0
+        
         try:
             metadata = {
                 'title': Path(file_path).stem,
-                'pages': len(pages),
+                'pages': page_count,
                 'authors': '',
                 'arxiv_id': ''
             }
@@ -509,19 +1171,14 @@ Context retrieved for the last question:
             # Пытаемся найти ArXiv ID в тексте
             if pages:
                 content = pages[0].page_content
-                import re
                 
-                arxiv_patterns = [
-                    r'arxiv:(\d+\.\d+)',
-                    r'arXiv:(\d+\.\d+)',
-                    r'(\d{4}\.\d{4,5})'
-                ]
-                
-                for pattern in arxiv_patterns:
-                    match = re.search(pattern, content, re.IGNORECASE)
-                    if match:
+                # ID с префиксом arXiv приоритетнее голого номера, встреченного раньше
+                for match in _ARXIV_RE.finditer(content):
+                    if match.group(1):
                         metadata['arxiv_id'] = match.group(1)
                         break
+                    if not metadata['arxiv_id']:
+                        metadata['arxiv_id'] = match.group(2)
             
             return metadata
             
@@ -529,18 +1186,23 @@ Context retrieved for the last question:
             logger.error(f"Ошибка извлечения метаданных: {e}")
             return {
                 'title': Path(file_path).stem,
-                'pages': len(pages) if pages else 0,
+                'pages': page_count,
                 'authors': '',
                 'arxiv_id': ''
             }
     
-    def answer_question(self, question: str, conversation_history: List = None) -> Dict[str, Any]:
+    async def aanswer_question(self, question: str, conversation_history: List = None,
+                               on_partial=None) -> Dict[str, Any]:
         """
         Ответ на вопрос через RAG с поддержкой диалогов (как в notebook)
         
+        Запросы к эмбеддингам и LLM выполняются асинхронно и не блокируют event loop бота
+        
         Args:
             question: Вопрос пользователя
             conversation_history: История диалога для conversational RAG
+            on_partial: Асинхронный колбэк, получающий накопленный текст ответа
+                по мере генерации LLM (для показа ответа до его завершения)
             
         Returns:
             Словарь с ответом и метаданными
@@ -553,50 +1215,81 @@ Context retrieved for the last question:
                     'quality': 'low'
                 }
             
+            await self.aensure_embeddings_started()
+            
+            # Эмбеддинг вопроса для семантического кэша (только для базовой цепочки)
+            question_embedding = None
+            
             # Если есть история диалога, используем conversational RAG
             if conversation_history and len(conversation_history) > 1:
                 logger.info("Используем conversational RAG с Query Transformation")
                 
                 # Создаем сообщения для conversational RAG
                 messages = []
-                for msg in conversation_history[-5:]:  # Берем последние 5 сообщений
+                for msg in conversation_history[-HISTORY_WINDOW:]:  # Берем только последние сообщения
                     if msg.get('role') == 'user':
                         messages.append(HumanMessage(content=msg.get('content', '')))
                     elif msg.get('role') == 'assistant':
                         messages.append(AIMessage(content=msg.get('content', '')))
                 
+                # Длинную историю сжимаем до того, как она уйдет в обе LLM цепочки
+                messages = await self._atrim_history(messages)
+                
                 # Добавляем текущий вопрос
                 messages.append(HumanMessage(content=question))
                 
-                # Используем RAG цепочку с Query Transformation (как в notebook)
-                answer = self.rag_query_transform_chain.invoke({"messages": messages})
-                
                 # Для коротких ответов типа "Да", "Нет" используем последний вопрос из истории
-                if len(question.strip()) <= 3 and conversation_history:
-                    # Берем последний вопрос пользователя из истории
-                    last_user_question = None
+                last_user_question = None
+                if len(question.strip()) <= 3:
                     for msg in reversed(conversation_history):
                         if msg.get('role') == 'user' and len(msg.get('content', '').strip()) > 3:
                             last_user_question = msg.get('content', '')
                             break
-                    
-                    if last_user_question:
-                        logger.info(f"Короткий ответ '{question}', используем последний вопрос: '{last_user_question}'")
-                        # Обновляем релевантные чанки на основе последнего вопроса
-                        relevant_chunks = self.retriever.invoke(last_user_question)
+                
+                if last_user_question:
+                    logger.info(f"Короткий ответ '{question}', используем последний вопрос: '{last_user_question}'")
+                    # Чанки по последнему вопросу ищем параллельно с генерацией ответа
+                    chain_result, relevant_chunks = await asyncio.gather(
+                        self._ainvoke_query_transform_chain(messages, on_partial),
+                        self._asearch_chunks(last_user_question)
+                    )
+                else:
+                    # Используем RAG цепочку с Query Transformation (как в notebook);
+                    # для анализа качества берем чанки, уже найденные цепочкой
+                    chain_result = await self._ainvoke_query_transform_chain(messages, on_partial)
+                    relevant_chunks = chain_result["chunks"]
+                
+                answer = chain_result["answer"]
                 
             else:
                 logger.info("Используем базовую RAG цепочку")
                 
-                # Используем базовую RAG цепочку (как в notebook)
-                answer = self.rag_chain.invoke(question)
+                # Проверяем семантический кэш: похожий вопрос уже мог быть задан
+                question_embedding = await self._aembed_question(question)
+                cached_result = self._find_cached_answer(question_embedding)
+                if cached_result is not None:
+                    logger.info(f"Ответ на вопрос '{question[:50]}...' взят из семантического кэша")
+                    return {**cached_result, 'cached': True}
                 
-                # Получаем релевантные чанки для анализа
-                relevant_chunks = self.retriever.invoke(question)
-            
-            # Если релевантные чанки еще не получены (для conversational RAG без коротких ответов)
-            if 'relevant_chunks' not in locals():
-                relevant_chunks = self.retriever.invoke(question)
+                # Ищем чанки один раз по уже посчитанному эмбеддингу и используем их
+                # и для контекста LLM, и для анализа качества (rag_chain повторно эмбеддил бы вопрос)
+                relevant_chunks = await self.vector_store.amax_marginal_relevance_search_by_vector(
+                    question_embedding.tolist(),
+                    k=RETRIEVER_K,
+                    fetch_k=RETRIEVER_FETCH_K,
+                    lambda_mult=RETRIEVER_LAMBDA_MULT
+                )
+                prompt_messages = self.question_answering_prompt.format_messages(
+                    context=self.format_chunks(relevant_chunks),
+                    question=question
+                )
+                if on_partial is None:
+                    answer = (await self.llm.ainvoke(prompt_messages)).content
+                else:
+                    answer = await self._acollect_stream(
+                        (chunk.content async for chunk in self.llm.astream(prompt_messages)),
+                        on_partial
+                    )
             
             # Очищаем ответ от лишних фраз "не нашел" если есть релевантный контент
             answer_cleaned = self._clean_answer(answer)
@@ -610,13 +1303,18 @@ Context retrieved for the last question:
             logger.info(f"RAG ответ на вопрос: {question[:50]}... (качество: {quality}, источник: {source}, чанков: {len(relevant_chunks)})")
             logger.info(f"Ответ: {answer_cleaned[:100]}...")
             
-            return {
+            result = {
                 'answer': answer_cleaned,
                 'source': source,
                 'quality': quality,
                 'chunks_used': len(relevant_chunks)
             }
             
+            if question_embedding is not None:
+                self._remember_answer(question_embedding, result)
+            
+            return result
+            
         except Exception as e:
             logger.error(f"Ошибка получения ответа: {e}")
             return {
@@ -625,6 +1323,203 @@ Context retrieved for the last question:
                 'quality': 'low'
             }
     
+    async def _acollect_stream(self, pieces, on_partial) -> str:
+        """
+        Сборка ответа из потока фрагментов
+        
+        В on_partial передается накопленный текст, очищенный так же, как итоговый
+        ответ (см. _stream_preview); возвращается исходный текст целиком
+        """
+        parts = []
+        shown = None
+        async for piece in pieces:
+            if not piece:
+                continue
+            parts.append(piece)
+            preview = self._stream_preview("".join(parts))
+            if preview is not None and preview != shown:
+                shown = preview
+                await on_partial(preview)
+        return "".join(parts)
+    
+    def _stream_preview(self, text: str) -> Optional[str]:
+        """
+        Текст потокового ответа для показа пользователю
+        
+        Повторяет очистку _clean_answer без логирования: убирает префикс RAG системы
+        и хвост с фразой "не нашел". Возвращает None, пока показывать нечего:
+        префикс еще не дописан целиком или ответ сводится к "не нашел",
+        который итоговое сообщение все равно заменит
+        """
+        stripped = text.lstrip()
+        if any(prefix.startswith(stripped) for prefix in _RAG_PREFIXES):
+            return None
+        
+        answer = _RAG_PREFIX_RE.sub('', stripped).strip()
+        no_answer_match = _NO_ANSWER_RE.search(answer.lower())
+        if no_answer_match is not None:
+            answer = answer[:no_answer_match.start()].strip()
+            if len(answer) <= 30:
+                return None
+        return answer or None
+    
+    async def _ainvoke_query_transform_chain(self, messages: List, on_partial=None) -> Dict[str, Any]:
+        """
+        Вызов RAG цепочки с Query Transformation
+        
+        С on_partial ответ LLM читается потоком: цепочка отдает найденные чанки
+        целиком, а ответ - фрагментами по мере генерации
+        
+        Returns:
+            Словарь цепочки с ключами chunks и answer
+        """
+        if on_partial is None:
+            return await self.rag_query_transform_chain.ainvoke({"messages": messages})
+        
+        chain_result = {}
+        
+        async def answer_pieces():
+            async for update in self.rag_query_transform_chain.astream({"messages": messages}):
+                for key, value in update.items():
+                    if key == 'answer':
+                        yield value
+                    else:
+                        chain_result[key] = value
+        
+        chain_result['answer'] = await self._acollect_stream(answer_pieces(), on_partial)
+        return chain_result
+    
+    async def astream_answer(self, question: str):
+        """
+        Потоковый ответ базовой RAG цепочки
+        
+        Фрагменты ответа отдаются по мере генерации LLM, поэтому первые слова
+        можно показать пользователю, не дожидаясь всего ответа
+        
+        Args:
+            question: Вопрос пользователя
+            
+        Yields:
+            Фрагменты текста ответа
+        """
+        if not self.rag_chain:
+            yield "RAG система не инициализирована. Сначала загрузите документ."
+            return
+        
+        await self.aensure_embeddings_started()
+        
+        async for chunk in self.rag_chain.astream(question):
+            yield chunk
+    
+    def _count_tokens(self, messages: List) -> int:
+        """Оценка числа токенов в сообщениях (без tiktoken - примерно 4 символа на токен)"""
+        text = "\n".join(message.content for message in messages)
+        if tiktoken is None:
+            return len(text) // 4
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    
+    async def _atrim_history(self, messages: List) -> List:
+        """
+        Ограничение истории диалога бюджетом токенов
+        
+        Если история не укладывается в HISTORY_TOKEN_BUDGET, все сообщения,
+        кроме последнего обмена репликами, заменяются кратким пересказом
+        
+        Args:
+            messages: Сообщения истории
+            
+        Returns:
+            Сообщения, укладывающиеся в бюджет
+        """
+        if len(messages) <= 2 or self._count_tokens(messages) <= HISTORY_TOKEN_BUDGET:
+            return messages
+        
+        older, recent = messages[:-2], messages[-2:]
+        try:
+            summary = await self.llm_query_transform.ainvoke(
+                older + [HumanMessage(content=HISTORY_SUMMARY_PROMPT)]
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сжать историю диалога, оставляем последние сообщения: {e}")
+            return recent
+        
+        logger.info(f"История диалога сжата: {len(older)} сообщений заменены пересказом")
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary.content}")] + recent
+    
+    async def _aembed_question(self, question: str):
+        """
+        Эмбеддинг вопроса с LRU-кэшем по нормализованному тексту
+        
+        Эмбеддинги не зависят от загруженного документа, поэтому кэш
+        не сбрасывается при смене PDF
+        """
+        key = _QUESTION_SPACES_RE.sub(' ', question.strip().lower())
+        key = _QUESTION_TRAILING_PUNCT_RE.sub('', key)
+        
+        cached = self._question_embedding_cache.get(key)
+        if cached is not None:
+            self._question_embedding_cache.move_to_end(key)
+            return cached
+        
+        question_embedding = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+        question_embedding.setflags(write=False)
+        
+        self._question_embedding_cache[key] = question_embedding
+        if len(self._question_embedding_cache) > QUESTION_EMBEDDING_CACHE_SIZE:
+            self._question_embedding_cache.popitem(last=False)
+        
+        return question_embedding
+    
+    def _find_cached_answer(self, question_embedding) -> Optional[Dict[str, Any]]:
+        """
+        Поиск ответа на близкий по смыслу вопрос в семантическом кэше
+        
+        Эмбеддинги text-embedding-3-large нормализованы, поэтому косинусная
+        близость считается скалярным произведением
+        
+        Args:
+            question_embedding: Эмбеддинг вопроса
+            
+        Returns:
+            Кэшированный результат или None
+        """
+        if not self._answer_cache_results:
+            return None
+        
+        # Пока буфер не заполнен, занятые строки - первые len(results)
+        scores = self._answer_cache_vectors[:len(self._answer_cache_results)] @ question_embedding
+        best = int(np.argmax(scores))
+        if scores[best] >= ANSWER_CACHE_SIMILARITY:
+            return self._answer_cache_results[best]
+        return None
+    
+    def _remember_answer(self, question_embedding, result: Dict[str, Any]) -> None:
+        """
+        Сохранение ответа в семантический кэш
+        
+        Эмбеддинги пишутся в заранее выделенный кольцевой буфер без копирования
+        матрицы; после заполнения новая запись вытесняет самую старую
+        """
+        if self._answer_cache_vectors is None:
+            self._answer_cache_vectors = np.empty(
+                (ANSWER_CACHE_SIZE, question_embedding.shape[0]),
+                dtype=question_embedding.dtype
+            )
+        
+        position = self._answer_cache_next
+        self._answer_cache_vectors[position] = question_embedding
+        if position < len(self._answer_cache_results):
+            self._answer_cache_results[position] = result
+        else:
+            self._answer_cache_results.append(result)
+        self._answer_cache_next = (position + 1) % ANSWER_CACHE_SIZE
+    
+    def _clear_answer_cache(self) -> None:
+        """Сброс семантического кэша при загрузке нового документа"""
+        self._answer_cache_vectors = None
+        self._answer_cache_results = []
+        self._answer_cache_next = 0
+    
     def _clean_answer(self, answer: str) -> str:
         """
         Очищает ответ от лишних фраз "не нашел" если есть релевантный контент
@@ -640,56 +1535,37 @@ Context retrieved for the last question:
             return answer
         
         # Удаляем префиксы RAG системы, если они есть в начале ответа
-        import re
-        answer = re.sub(r'^📄 Ответ RAG системы:\s*\n?', '', answer, flags=re.MULTILINE)
-        answer = re.sub(r'^Ответ RAG системы:\s*\n?', '', answer, flags=re.MULTILINE)
-        answer = re.sub(r'^📄 Ответ на основе документа:\s*\n?', '', answer, flags=re.MULTILINE)
-        answer = re.sub(r'^📄 Ответ на основе документа \(частично\):\s*\n?', '', answer, flags=re.MULTILINE)
-        answer = answer.strip()
-        
-        no_answer_phrases = ["не нашел ответа", "я не нашел"]
-        answer_lower = answer.lower()
-        
-        # Проверяем есть ли фраза "не нашел"
-        for phrase in no_answer_phrases:
-            if phrase in answer_lower:
-                # Находим позицию начала фразы
-                phrase_pos = answer_lower.find(phrase)
-                # Если ДО фразы есть достаточно контента (>30 символов),
-                # убираем фразу "не нашел" и все что после нее
-                if len(answer[:phrase_pos].strip()) > 30:
-                    # Удаляем все начиная с "не нашел" до конца
-                    cleaned = answer[:phrase_pos].strip()
-                    logger.info(f"Очищен ответ: удалено '{phrase}' и текст после него (было {len(answer)} символов, стало {len(cleaned)})")
-                    return cleaned
+        answer = _RAG_PREFIX_RE.sub('', answer).strip()
+        
+        # Ищем фразу "не нашел" (в том числе с "ё") тем же выражением, что и анализ качества
+        no_answer_match = _NO_ANSWER_RE.search(answer.lower())
+        if no_answer_match is not None:
+            phrase_pos = no_answer_match.start()
+            # Если ДО фразы есть достаточно контента (>30 символов),
+            # убираем фразу "не нашел" и все что после нее
+            if len(answer[:phrase_pos].strip()) > 30:
+                # Удаляем все начиная с "не нашел" до конца
+                cleaned = answer[:phrase_pos].strip()
+                logger.info(f"Очищен ответ: удалено '{no_answer_match.group()}' и текст после него (было {len(answer)} символов, стало {len(cleaned)})")
+                return cleaned
         
         return answer
     
     def _analyze_answer_quality(self, question: str, answer: str, chunks: List) -> str:
         """Анализ качества ответа"""
         try:
+            # Без найденных чанков ответ из документа невозможен - дальше не считаем
+            if not chunks:
+                logger.info("Низкое качество: чанки не найдены")
+                return 'low'
+            
             # Более гибкий анализ качества
             question_lower = question.lower()
             answer_lower = answer.lower()
             
             # Проверяем, содержит ли ответ ключевые слова из вопроса
-            question_words = set(question_lower.split())
-            answer_words = set(answer_lower.split())
-            
-            logger.info(f"Анализ качества: вопрос='{question}', слова вопроса={question_words}")
-            logger.info(f"Ответ: {answer[:200]}...")
-            logger.info(f"Чанки найдены: {len(chunks)}")
-            if chunks:
-                logger.info(f"Первый чанк: {chunks[0].page_content[:200]}...")
-                for i, chunk in enumerate(chunks):
-                    logger.info(f"Чанк {i+1}: {chunk.page_content[:100]}...")
-            
-            # Подсчитываем пересечение слов
-            common_words = question_words.intersection(answer_words)
-            overlap_ratio = len(common_words) / len(question_words) if question_words else 0
-            
-            # Проверяем, есть ли релевантные чанки (определяем раньше, чтобы использовать ниже)
-            has_relevant_chunks = len(chunks) > 0
+            # (слова без пунктуации, чтобы "бустинг?" совпадал с "бустинг")
+            question_words = set(_WORD_RE.findall(question_lower))
             
             # Дополнительная проверка: ищем ключевые слова из вопроса в ответе
             key_words_in_answer = False
@@ -699,75 +1575,19 @@ Context retrieved for the last question:
                     logger.info(f"Найдено ключевое слово '{q_word}' в ответе")
                     break
             
-            # Проверяем наличие информации в чанках
-            if has_relevant_chunks:
-                chunks_content = " ".join([chunk.page_content.lower() for chunk in chunks])
-                chunks_words = set(chunks_content.split())
-                chunks_overlap = question_words.intersection(chunks_words)
-                chunks_ratio = len(chunks_overlap) / len(question_words) if question_words else 0
-            else:
-                chunks_ratio = 0
-            
-            # Дополнительная проверка: ищем похожие слова (для случаев типа "беггинг" vs "бэггинг")
-            similar_words_found = False
-            
-            # Специальные случаи для русских слов с разным написанием
-            word_variations = {
-                'беггинг': ['бэггинг', 'bagging'],
-                'бэггинг': ['беггинг', 'bagging'],
-                'bagging': ['беггинг', 'бэггинг'],
-                'бустинг': ['бустинг', 'boosting'],
-                'boosting': ['бустинг', 'бустинг'],
-                'ансамбль': ['ensemble'],
-                'ensemble': ['ансамбль']
-            }
-            
-            for q_word in question_words:
-                if len(q_word) > 3:  # Только для слов длиннее 3 символов
-                    # Проверяем вариации слова
-                    variations_to_check = [q_word]
-                    if q_word in word_variations:
-                        variations_to_check.extend(word_variations[q_word])
-                    
-                    for chunk in chunks:
-                        chunk_text = chunk.page_content.lower()
-                        # Проверяем все вариации слова
-                        for variation in variations_to_check:
-                            if variation in chunk_text:
-                                similar_words_found = True
-                                logger.info(f"Найдено похожее слово: '{q_word}' -> '{variation}' в чанке")
-                                logger.info(f"Содержимое чанка: {chunk_text[:200]}...")
-                                break
-                        if similar_words_found:
-                            break
-                    if similar_words_found:
-                        break
-            
             # Проверяем, является ли вопрос общим вопросом о содержании
             general_phrases = ["о чем данная", "about what", "what is this about", "what is the article about",
                               "о чем статья", "what is it about", "что это о", "о чем это"]
             is_general = any(phrase in question_lower for phrase in general_phrases)
             
-            # Проверяем пересечение ОТВЕТА с чанками (детекция галлюцинаций)
-            # Это особенно важно для общих вопросов и вопросов на разных языках
-            answer_chunks_meaningful_overlap = 0
-            if has_relevant_chunks:
-                answer_chunks_overlap = answer_words.intersection(chunks_words)
-                answer_chunks_meaningful_overlap = len([w for w in answer_chunks_overlap if len(w) > 3])
-            
             # Проверяем, не является ли ответ стандартным "не нашел"
-            # Сначала ищем фразу "не нашел" в ответе
-            no_answer_phrases = ["не нашел ответа", "я не нашел"]
-            has_no_answer_phrase = any(phrase in answer_lower for phrase in no_answer_phrases)
+            # Сначала ищем фразу "не нашел" в ответе (один проход регулярным выражением)
+            no_answer_match = _NO_ANSWER_RE.search(answer_lower)
             
             # Если есть фраза "не нашел", проверяем есть ли контент ДО этой фразы
-            if has_no_answer_phrase:
-                # Находим позицию начала фразы "не нашел"
-                no_answer_pos = min([
-                    answer_lower.find(phrase) 
-                    for phrase in no_answer_phrases 
-                    if phrase in answer_lower
-                ])
+            if no_answer_match is not None:
+                # Позиция начала фразы "не нашел"
+                no_answer_pos = no_answer_match.start()
                 # Если ДО фразы "не нашел" есть существенный контент (больше 30 символов),
                 # считаем что ответ есть, просто LLM добавил лишнее в конце
                 content_before_no = answer_lower[:no_answer_pos].strip()
@@ -776,6 +1596,63 @@ Context retrieved for the last question:
             else:
                 is_standard_no_answer = False
             
+            # Стандартный "не нашел" на конкретный вопрос - низкое качество без подсчета
+            # пересечений слов с чанками (для общих вопросов они еще нужны ниже)
+            if is_standard_no_answer and not is_general:
+                logger.info("Низкое качество: стандартный ответ 'не нашел'")
+                return 'low'
+            
+            answer_words = set(_WORD_RE.findall(answer_lower))
+            
+            logger.info(f"Анализ качества: вопрос='{question}', слова вопроса={question_words}")
+            logger.info(f"Ответ: {answer[:200]}...")
+            logger.info(f"Чанки найдены: {len(chunks)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, chunk in enumerate(chunks):
+                    logger.debug(f"Чанк {i+1}: {chunk.page_content[:100]}...")
+            
+            # Подсчитываем пересечение слов
+            common_words = question_words.intersection(answer_words)
+            overlap_ratio = len(common_words) / len(question_words) if question_words else 0
+            
+            # Релевантные чанки есть: пустой список отсечен в начале
+            has_relevant_chunks = True
+            
+            # Проверяем наличие информации в чанках
+            chunks_words = self._chunk_words(chunks)
+            chunks_overlap = len(question_words & chunks_words)
+            chunks_ratio = chunks_overlap / len(question_words) if question_words else 0
+            
+            # Дополнительная проверка: ищем похожие слова (для случаев типа "беггинг" vs "бэггинг")
+            similar_words_found = False
+            
+            # Все слова вопроса длиннее 3 символов и их вариации (специальные случаи для
+            # слов с разным написанием) ищутся одним регулярным выражением за проход по чанку
+            variations_to_check = {
+                variation
+                for q_word in question_words if len(q_word) > 3
+                for variation in (q_word, *_WORD_VARIATIONS.get(q_word, ()))
+            }
+            if variations_to_check:
+                # Длинные варианты раньше коротких, чтобы в лог попадало полное совпадение.
+                # Регистр игнорирует само выражение: копия чанка в нижнем регистре не создается
+                variations_pattern = re.compile("|".join(
+                    re.escape(variation) for variation in sorted(variations_to_check, key=len, reverse=True)
+                ), re.IGNORECASE)
+                for chunk in chunks:
+                    match = variations_pattern.search(chunk.page_content)
+                    if match is not None:
+                        similar_words_found = True
+                        logger.info(f"Найдено похожее слово: '{match.group().lower()}' в чанке")
+                        logger.debug(f"Содержимое чанка: {chunk.page_content[:200]}...")
+                        break
+            
+            # Проверяем пересечение ОТВЕТА с чанками (детекция галлюцинаций)
+            # Это особенно важно для общих вопросов и вопросов на разных языках
+            answer_chunks_meaningful_overlap = sum(
+                1 for word in answer_words & chunks_words if len(word) > 3
+            )
+            
             # Более гибкие критерии качества
             logger.info(f"Критерии: has_chunks={has_relevant_chunks}, is_general={is_general}, is_no_answer={is_standard_no_answer}, answer_chunks_overlap={answer_chunks_meaningful_overlap}, key_words={key_words_in_answer}, similar={similar_words_found}")
             
@@ -825,10 +1702,13 @@ Context retrieved for the last question:
                 logger.warning("Векторное хранилище не инициализировано")
                 return ["Основная идея статьи", "Методы и подходы", "Результаты и выводы"]
             
-            # Получаем все документы из хранилища через поиск
-            # InMemoryVectorStore не имеет get_all_documents(), используем поиск
+            # Темы не меняются, пока не загружен новый документ
+            # (сравниваем сам объект: id освобожденного хранилища может достаться новому)
+            if self._topics_cache is not None and self._topics_cache[0] is self.vector_store:
+                return self._topics_cache[1]
+            
             try:
-                all_docs = self.vector_store.similarity_search("", k=1000)  # Получаем все документы
+                all_docs = self._all_documents()
             except Exception as e:
                 logger.error(f"Ошибка поиска в векторном хранилище: {e}")
                 return ["Основная идея статьи", "Методы и подходы", "Результаты и выводы"]
@@ -844,37 +1724,52 @@ Context retrieved for the last question:
             topics = self._extract_topics_from_text(full_text)
             
             logger.info(f"Извлечено {len(topics)} тем из документа")
+            self._topics_cache = (self.vector_store, topics)
             return topics
             
         except Exception as e:
             logger.error(f"Ошибка извлечения тем: {e}")
             return ["Основная идея статьи", "Методы и подходы", "Результаты и выводы"]
     
+    def _all_documents(self) -> List:
+        """
+        Все чанки векторного хранилища
+        
+        InMemoryVectorStore и FAISS хранят документы в словарях, поэтому они читаются
+        напрямую, без эмбеддинга пустого запроса и поиска по всему хранилищу
+        """
+        docstore = getattr(self.vector_store, 'docstore', None)
+        if docstore is not None:
+            return [
+                docstore.search(doc_id)
+                for doc_id in self.vector_store.index_to_docstore_id.values()
+            ]
+        
+        store = getattr(self.vector_store, 'store', None)
+        if store is None:
+            return self.vector_store.similarity_search("", k=1000)
+        
+        return [
+            Document(page_content=entry['text'], metadata=entry.get('metadata', {}))
+            for entry in store.values()
+        ]
+    
     def _extract_topics_from_text(self, text: str) -> List[str]:
         """Извлечение тем из текста"""
         try:
-            import re
-            
-            # Ищем заголовки и ключевые фразы
+            # Ищем заголовки и ключевые фразы. Нужны только первые 3 темы в порядке
+            # приоритета паттернов, поэтому поиск прекращается, как только они найдены
             topics = []
             
-            # Паттерны для поиска тем
-            patterns = [
-                r'## (.+)',  # Markdown заголовки
-                r'# (.+)',   # Markdown заголовки
-                r'Abstract[:\s]*(.+)',  # Abstract
-                r'Introduction[:\s]*(.+)',  # Introduction
-                r'Method[:\s]*(.+)',  # Method
-                r'Result[:\s]*(.+)',  # Results
-                r'Conclusion[:\s]*(.+)',  # Conclusion
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-                for match in matches:
-                    topic = match.strip()[:100]  # Ограничиваем длину
+            for pattern in _TOPIC_PATTERNS:
+                for match in pattern.finditer(text):
+                    topic = match.group(1).strip()[:100]  # Ограничиваем длину
                     if len(topic) > 10 and topic not in topics:
                         topics.append(topic)
+                        if len(topics) >= 3:
+                            break
+                if len(topics) >= 3:
+                    break
             
             # Если не нашли тем, создаем общие
             if not topics:
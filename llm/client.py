@@ -1,7 +1,9 @@
 """Клиент для работы с LLM API через OpenRouter"""
 
+import asyncio
 import os
 import logging
+from typing import List, Optional
 from openai import AsyncOpenAI
 
 
@@ -49,6 +51,86 @@ def get_openai_client():
     return _openai_client
 
 
+async def _request_completion(client, model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    """
+    Запрос ответа у одной модели с очисткой служебных токенов
+    
+    Raises:
+        Exception: При ошибках обращения к API
+    """
+    # Запрос к OpenRouter API с полной историей диалога
+    response = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    
+    # Извлечение текста ответа
+    answer = response.choices[0].message.content
+    
+    # Очистка ответа от токенов модели
+    if answer:
+        # Убираем токены начала и конца
+        answer = answer.strip()
+        if answer.startswith('<s>'):
+            answer = answer[3:].strip()
+        if answer.endswith('</s>'):
+            answer = answer[:-4].strip()
+        
+        # Убираем другие служебные токены
+        answer = answer.replace('[OUT]', '').strip()
+        answer = answer.replace('[INST]', '').strip()
+        answer = answer.replace('[/INST]', '').strip()
+    
+    # Логирование ответа
+    logger.info(
+        f"Ответ от LLM | Модель: {model} | Длина: {len(answer)} символов | "
+        f"Начало: {answer[:50]}{'...' if len(answer) > 50 else ''}"
+    )
+    
+    return answer
+
+
+async def _race_models(client, models: List[str], messages: list, temperature: float, max_tokens: int) -> Optional[str]:
+    """
+    Одновременный запрос к нескольким моделям: берется первый успешный ответ
+    
+    Время ответа равно времени самой быстрой доступной модели, а не сумме
+    таймаутов недоступных. Оставшиеся запросы отменяются
+    
+    Returns:
+        Ответ первой успешно ответившей модели или None, если не ответила ни одна
+    """
+    logger.info(f"Параллельный запрос к моделям: {', '.join(models)}")
+    tasks = {
+        asyncio.create_task(_request_completion(client, model, messages, temperature, max_tokens)): model
+        for model in models
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Исключения забираем у всех завершившихся задач до возврата ответа,
+            # иначе asyncio сообщит "Task exception was never retrieved"
+            answer = None
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if answer is None:
+                        answer = task.result()
+                else:
+                    logger.error(f"Ошибка с моделью {tasks[task]}: {type(error).__name__}: {error}")
+            if answer is not None:
+                return answer
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        # Дожидаемся отмены, чтобы запросы не оставались висеть после возврата
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
 async def get_llm_response(messages: list) -> str:
     """
     Получение ответа от LLM на основе истории диалога
@@ -93,6 +175,9 @@ async def get_llm_response(messages: list) -> str:
     model = os.getenv('LLM_MODEL', fallback_models[0])
     temperature = float(os.getenv('LLM_TEMPERATURE', '0.7'))
     max_tokens = int(os.getenv('LLM_MAX_TOKENS', '500'))
+    # Сколько первых моделей опрашивать одновременно (1 - по очереди). Параллельный
+    # запрос быстрее при недоступных моделях, но расходует квоту API на каждую из них
+    race_models = int(os.getenv('LLM_RACE_MODELS', '1'))
     
     # Логирование запроса
     logger.info(
@@ -100,52 +185,27 @@ async def get_llm_response(messages: list) -> str:
         f"Сообщений в истории: {len(messages)}"
     )
     
+    remaining_models = fallback_models
+    if race_models > 1:
+        answer = await _race_models(client, fallback_models[:race_models], messages, temperature, max_tokens)
+        if answer is not None:
+            return answer
+        remaining_models = fallback_models[race_models:]
+    
     # Пробуем разные модели, если основная не работает
-    for attempt, current_model in enumerate(fallback_models):
+    for attempt, current_model in enumerate(remaining_models):
         try:
             logger.info(f"Попытка {attempt + 1}: используем модель {current_model}")
-            
-            # Запрос к OpenRouter API с полной историей диалога
-            response = await client.chat.completions.create(
-                model=current_model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            
-            # Извлечение текста ответа
-            answer = response.choices[0].message.content
-            
-            # Очистка ответа от токенов модели
-            if answer:
-                # Убираем токены начала и конца
-                answer = answer.strip()
-                if answer.startswith('<s>'):
-                    answer = answer[3:].strip()
-                if answer.endswith('</s>'):
-                    answer = answer[:-4].strip()
-                
-                # Убираем другие служебные токены
-                answer = answer.replace('[OUT]', '').strip()
-                answer = answer.replace('[INST]', '').strip()
-                answer = answer.replace('[/INST]', '').strip()
-            
-            # Логирование ответа
-            logger.info(
-                f"Ответ от LLM | Модель: {current_model} | Длина: {len(answer)} символов | "
-                f"Начало: {answer[:50]}{'...' if len(answer) > 50 else ''}"
-            )
-            
-            return answer
+            return await _request_completion(client, current_model, messages, temperature, max_tokens)
             
         except Exception as e:
             logger.error(f"Ошибка с моделью {current_model}: {type(e).__name__}: {e}")
-            if attempt < len(fallback_models) - 1:
+            if attempt < len(remaining_models) - 1:
                 logger.info(f"Пробуем следующую модель...")
                 continue
-            else:
-                logger.error("Все модели недоступны")
-                return ""
+    
+    logger.error("Все модели недоступны")
+    return ""
 
 
 async def get_llm_response_for_test(prompt: str) -> str:
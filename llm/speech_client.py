@@ -2,14 +2,36 @@
 Модуль для работы с транскрипцией аудио через Hugging Face Whisper API
 """
 
-import tempfile
+import asyncio
 import os
 import logging
-import requests
+import httpx
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# Таймаут запроса к Hugging Face API (распознавание длинного сообщения занимает время)
+HF_REQUEST_TIMEOUT = 120
+
+# Размер порции при потоковой отправке аудио-файла
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Общий асинхронный HTTP-клиент всех экземпляров (создается в event loop при первом запросе)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """
+    Общий httpx.AsyncClient для запросов к Hugging Face API
+    
+    Соединение с API переиспользуется между голосовыми сообщениями,
+    без нового TCP/TLS рукопожатия на каждый запрос
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=HF_REQUEST_TIMEOUT)
+    return _http_client
+
 
 class HuggingFaceSpeechClient:
     """
@@ -66,43 +88,13 @@ class HuggingFaceSpeechClient:
             
             logger.info(f"Начинаем транскрипцию файла: {audio_path}")
             
-            # Транскрибируем аудио через Hugging Face API
-            with open(audio_path, 'rb') as audio_file:
-                # Определяем правильный Content-Type для файла
-                content_type = "audio/ogg"  # По умолчанию для .ogg файлов
-                if audio_path.endswith('.wav'):
-                    content_type = "audio/wav"
-                elif audio_path.endswith('.mp3'):
-                    content_type = "audio/mpeg"
-                elif audio_path.endswith('.flac'):
-                    content_type = "audio/flac"
-                
-                # Отправляем файл напрямую с правильным Content-Type
-                response = requests.post(
-                    self.api_url,
-                    headers={
-                        **self.headers,
-                        "Content-Type": content_type
-                    },
-                    data=audio_file.read()
-                )
-            
-            # Проверяем статус ответа
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, dict) and 'text' in result:
-                    transcribed_text = result['text'].strip()
-                elif isinstance(result, list) and len(result) > 0:
-                    transcribed_text = result[0].get('text', '').strip()
-                else:
-                    raise ValueError(f"Неожиданный формат ответа от API: {result}")
-                
-                logger.info(f"Транскрипция завершена. Длина текста: {len(transcribed_text)} символов")
-                return transcribed_text
-            else:
-                error_msg = f"Ошибка API: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+            # Транскрибируем аудио через Hugging Face API: файл отправляется порциями,
+            # без чтения целиком в память
+            return await self._post_audio(
+                _iter_file(audio_path),
+                _content_type(audio_path),
+                content_length=file_size
+            )
                 
         except Exception as e:
             logger.error(f"Ошибка при транскрипции аудио: {e}")
@@ -131,45 +123,76 @@ class HuggingFaceSpeechClient:
             
             logger.info(f"Начинаем транскрипцию аудио-данных размером {data_size} байт")
             
-            # Определяем правильный Content-Type для файла
-            content_type = "audio/ogg"  # По умолчанию для .ogg файлов
-            if file_extension.endswith('.wav'):
-                content_type = "audio/wav"
-            elif file_extension.endswith('.mp3'):
-                content_type = "audio/mpeg"
-            elif file_extension.endswith('.flac'):
-                content_type = "audio/flac"
-            
             # Отправляем данные напрямую с правильным Content-Type
-            response = requests.post(
-                self.api_url,
-                headers={
-                    **self.headers,
-                    "Content-Type": content_type
-                },
-                data=audio_data
-            )
-            
-            # Проверяем статус ответа
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, dict) and 'text' in result:
-                    transcribed_text = result['text'].strip()
-                elif isinstance(result, list) and len(result) > 0:
-                    transcribed_text = result[0].get('text', '').strip()
-                else:
-                    raise ValueError(f"Неожиданный формат ответа от API: {result}")
-                
-                logger.info(f"Транскрипция завершена. Длина текста: {len(transcribed_text)} символов")
-                return transcribed_text
-            else:
-                error_msg = f"Ошибка API: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+            return await self._post_audio(audio_data, _content_type(file_extension))
                 
         except Exception as e:
             logger.error(f"Ошибка при транскрипции аудио-данных: {e}")
             raise
+    
+    async def _post_audio(self, audio_data, content_type: str, content_length: Optional[int] = None) -> str:
+        """
+        Отправляет аудио в Hugging Face API и возвращает распознанный текст
+        
+        Запрос асинхронный: пока API распознает речь, event loop бота обслуживает
+        других пользователей, а несколько запросов идут одновременно
+        
+        Args:
+            audio_data: Байты аудио или асинхронный итератор их порций
+            content_type: Content-Type аудио
+            content_length: Размер аудио, если данные передаются итератором
+        """
+        headers = {
+            **self.headers,
+            "Content-Type": content_type
+        }
+        if content_length is not None:
+            # С известной длиной тело уходит потоком без chunked-кодирования
+            headers["Content-Length"] = str(content_length)
+        
+        response = await _get_http_client().post(
+            self.api_url,
+            headers=headers,
+            content=audio_data
+        )
+        
+        # Проверяем статус ответа
+        if response.status_code == 200:
+            result = response.json()
+            if isinstance(result, dict) and 'text' in result:
+                transcribed_text = result['text'].strip()
+            elif isinstance(result, list) and len(result) > 0:
+                transcribed_text = result[0].get('text', '').strip()
+            else:
+                raise ValueError(f"Неожиданный формат ответа от API: {result}")
+            
+            logger.info(f"Транскрипция завершена. Длина текста: {len(transcribed_text)} символов")
+            return transcribed_text
+        else:
+            error_msg = f"Ошибка API: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+
+async def _iter_file(path: str):
+    """Порции файла для потоковой отправки (чтение диска идет в отдельном потоке)"""
+    with open(path, 'rb') as audio_file:
+        while True:
+            chunk = await asyncio.to_thread(audio_file.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _content_type(file_name: str) -> str:
+    """Content-Type аудио по расширению файла"""
+    if file_name.endswith('.wav'):
+        return "audio/wav"
+    elif file_name.endswith('.mp3'):
+        return "audio/mpeg"
+    elif file_name.endswith('.flac'):
+        return "audio/flac"
+    return "audio/ogg"  # По умолчанию для .ogg файлов
 
 
 # Глобальный экземпляр клиента (ленивая инициализация)
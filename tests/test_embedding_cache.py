@@ -0,0 +1,99 @@
+"""Тесты дискового кэша эмбеддингов"""
+
+import asyncio
+
+import numpy as np
+
+from bot.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class FakeEmbeddings:
+    """Модель эмбеддингов, запоминающая тексты, которые у нее запросили"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def _vector(self, text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 0.5]
+    
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+    
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+    
+    def embed_query(self, text):
+        self.calls.append([text])
+        return self._vector(text)
+    
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+def _cached_embeddings(tmp_path):
+    model = FakeEmbeddings()
+    cache = EmbeddingCache(tmp_path / 'cache' / 'embeddings.sqlite3')
+    return model, CachedEmbeddings(model, 'fake-model', cache)
+
+
+def test_only_missing_texts_are_embedded(tmp_path):
+    model, embeddings = _cached_embeddings(tmp_path)
+    
+    embeddings.embed_documents(['альфа', 'бета'])
+    embeddings.embed_documents(['бета', 'гамма', 'альфа'])
+    
+    assert model.calls == [['альфа', 'бета'], ['гамма']]
+
+
+def test_order_is_preserved_with_duplicate_texts(tmp_path):
+    model, embeddings = _cached_embeddings(tmp_path)
+    texts = ['a', 'bb', 'a', 'ccc', 'bb']
+    
+    vectors = embeddings.embed_documents(texts)
+    
+    assert model.calls == [['a', 'bb', 'ccc']]
+    assert vectors == [model._vector(text) for text in texts]
+
+
+def test_vectors_round_trip_through_float16(tmp_path):
+    model, embeddings = _cached_embeddings(tmp_path)
+    vector = [0.1234567, -0.7654321, 3.0]
+    cache = embeddings.cache
+    
+    cache.put_many({'key': vector})
+    restored = cache.get_many(['key', 'missing'])
+    
+    assert list(restored) == ['key']
+    np.testing.assert_array_equal(
+        restored['key'],
+        np.asarray(vector, dtype=np.float16).astype(np.float32)
+    )
+    np.testing.assert_allclose(restored['key'], vector, rtol=1e-3)
+
+
+def test_cache_is_keyed_by_model_name(tmp_path):
+    model, embeddings = _cached_embeddings(tmp_path)
+    other = CachedEmbeddings(model, 'other-model', embeddings.cache)
+    
+    embeddings.embed_query('вопрос')
+    other.embed_query('вопрос')
+    
+    assert model.calls == [['вопрос'], ['вопрос']]
+
+
+def test_async_methods_use_the_cache(tmp_path):
+    model, embeddings = _cached_embeddings(tmp_path)
+    
+    async def run():
+        first = await embeddings.aembed_documents(['x', 'y', 'x'])
+        second = await embeddings.aembed_documents(['y', 'z'])
+        query = await embeddings.aembed_query('z')
+        return first, second, query
+    
+    first, second, query = asyncio.run(run())
+    
+    assert model.calls == [['x', 'y'], ['z']]
+    assert first == [model._vector('x'), model._vector('y'), model._vector('x')]
+    assert second == [model._vector('y'), model._vector('z')]
+    assert query == model._vector('z')
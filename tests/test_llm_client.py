@@ -0,0 +1,96 @@
+"""Тесты параллельного запроса к нескольким моделям"""
+
+import asyncio
+import gc
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('openai')
+
+from llm import client as llm_client
+
+
+def _run_race(monkeypatch, behaviours):
+    """
+    Запускает _race_models с подменой запроса к модели
+    
+    Returns:
+        (ответ, отмененные модели, ошибки, о которых сообщил event loop)
+    """
+    cancelled = []
+    loop_errors = []
+    succeeded = set()
+    
+    async def fake_request(client, model, messages, temperature, max_tokens):
+        delay, outcome = behaviours[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        succeeded.add(asyncio.current_task())
+        return outcome
+    
+    async def wait_successes_first(tasks, **kwargs):
+        # Успешные задачи идут первыми: так проверяется, что исключения
+        # остальных завершившихся задач забираются и после найденного ответа
+        done, pending = await asyncio.wait(tasks, **kwargs)
+        return sorted(done, key=lambda task: task not in succeeded), pending
+    
+    monkeypatch.setattr(llm_client, '_request_completion', fake_request)
+    monkeypatch.setattr(llm_client, 'asyncio', SimpleNamespace(
+        create_task=asyncio.create_task,
+        wait=wait_successes_first,
+        gather=asyncio.gather,
+        FIRST_COMPLETED=asyncio.FIRST_COMPLETED
+    ))
+    
+    async def race():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: loop_errors.append(context))
+        answer = await llm_client._race_models(None, list(behaviours), [], 0.7, 100)
+        # Отмененные запросы должны завершиться до возврата из _race_models
+        cancelled_on_return = list(cancelled)
+        # Незабранные исключения задач сообщаются при сборке мусора
+        gc.collect()
+        await asyncio.sleep(0)
+        return answer, cancelled_on_return
+    
+    answer, cancelled_on_return = asyncio.run(race())
+    return answer, cancelled_on_return, loop_errors
+
+
+def test_first_success_wins_and_slow_models_are_cancelled(monkeypatch):
+    answer, cancelled, loop_errors = _run_race(monkeypatch, {
+        'fast': (0.01, 'быстрый ответ'),
+        'slow': (10, 'медленный ответ'),
+    })
+    
+    assert answer == 'быстрый ответ'
+    assert cancelled == ['slow']
+    assert loop_errors == []
+
+
+def test_failure_finishing_with_success_is_retrieved(monkeypatch):
+    answer, cancelled, loop_errors = _run_race(monkeypatch, {
+        'broken': (0, RuntimeError('модель недоступна')),
+        'ok': (0, 'ответ'),
+        'slow': (10, 'медленный ответ'),
+    })
+    
+    assert answer == 'ответ'
+    assert cancelled == ['slow']
+    assert loop_errors == []
+
+
+def test_all_models_failing_returns_none(monkeypatch):
+    answer, cancelled, loop_errors = _run_race(monkeypatch, {
+        'first': (0, RuntimeError('ошибка')),
+        'second': (0.01, ValueError('ошибка')),
+    })
+    
+    assert answer is None
+    assert cancelled == []
+    assert loop_errors == []
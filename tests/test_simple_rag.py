@@ -0,0 +1,152 @@
+"""Тесты SimpleRAG, не требующие LangChain и API"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import bot.simple_rag as simple_rag
+from bot.simple_rag import SimpleRAG
+
+
+class Doc:
+    """Минимальная замена langchain Document"""
+    
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setattr(simple_rag, 'Document', Doc)
+    rag = SimpleRAG.__new__(SimpleRAG)
+    rag._chunk_word_sets = {}
+    return rag
+
+
+def test_chunk_word_sets_are_built_once_and_reused(rag):
+    chunks = [Doc("Градиентный спуск, шаг обучения."), Doc("Шаг обучения и Momentum!")]
+    
+    rag._chunk_word_sets = rag._build_chunk_word_sets(chunks)
+    
+    assert rag._chunk_word_sets[chunks[0].page_content] == {'градиентный', 'спуск', 'шаг', 'обучения'}
+    assert rag._chunk_words(chunks) == {'градиентный', 'спуск', 'шаг', 'обучения', 'и', 'momentum'}
+    
+    # Готовые множества не пересчитываются из текста
+    rag._chunk_word_sets[chunks[1].page_content] = frozenset({'кэш'})
+    assert 'momentum' not in rag._chunk_words(chunks)
+
+
+def test_chunk_words_fill_missing_sets_lazily(rag):
+    chunk = Doc("Batch normalization")
+    
+    assert rag._chunk_words([chunk]) == {'batch', 'normalization'}
+    assert chunk.page_content in rag._chunk_word_sets
+    assert '_word_set' not in chunk.metadata
+
+
+@pytest.mark.parametrize('phrase', ['не нашел ответа', 'не нашёл ответа', 'Я не нашёл', 'я не нашел'])
+def test_clean_answer_drops_no_answer_tail(rag, phrase):
+    content = "Градиентный спуск обновляет веса против направления градиента."
+    
+    assert rag._clean_answer(f"{content} Но {phrase} на второй вопрос в документе.") == f"{content} Но"
+
+
+def test_clean_answer_keeps_short_no_answer(rag):
+    answer = "Я не нашёл ответа в документе."
+    
+    assert rag._clean_answer(answer) == answer
+
+
+def _stream(rag, pieces):
+    """Прогоняет фрагменты через _acollect_stream и возвращает показанные тексты и ответ"""
+    shown = []
+    
+    async def collect():
+        async def on_partial(text):
+            shown.append(text)
+        
+        async def generate():
+            for piece in pieces:
+                yield piece
+        
+        return await rag._acollect_stream(generate(), on_partial)
+    
+    return shown, asyncio.run(collect())
+
+
+def test_stream_hides_rag_prefix(rag):
+    pieces = ["📄 Отв", "ет RAG сис", "темы:\n", "Град", "иентный спуск", " уменьшает ошибку."]
+    
+    shown, answer = _stream(rag, pieces)
+    
+    assert answer == "".join(pieces)
+    assert shown == ["Град", "Градиентный спуск", "Градиентный спуск уменьшает ошибку."]
+    assert shown[-1] == rag._clean_answer(answer)
+
+
+def test_stream_hides_no_answer_tail(rag):
+    content = "Градиентный спуск обновляет веса против градиента."
+    pieces = [content, " Но я не на", "шёл ответа", " на второй вопрос."]
+    
+    shown, answer = _stream(rag, pieces)
+    
+    assert all('нашёл' not in text for text in shown)
+    assert shown[-1] == rag._clean_answer(answer) == content + " Но"
+
+
+def test_stream_shows_nothing_for_bare_no_answer(rag):
+    shown, _ = _stream(rag, ["Я не нашёл", " ответа в документе."])
+    
+    assert shown == []
+
+
+@pytest.fixture
+def answer_cache(rag, monkeypatch):
+    monkeypatch.setattr(simple_rag, 'np', np)
+    monkeypatch.setattr(simple_rag, 'ANSWER_CACHE_SIZE', 3)
+    rag._clear_answer_cache()
+    return rag
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_answer_cache_hit_and_miss(answer_cache):
+    answer_cache._remember_answer(_unit(1, 0, 0), {'answer': 'первый'})
+    
+    assert answer_cache._find_cached_answer(_unit(1, 0.01, 0)) == {'answer': 'первый'}
+    # Косинусная близость 0.8 ниже порога ANSWER_CACHE_SIMILARITY
+    assert answer_cache._find_cached_answer(_unit(0.8, 0.6, 0)) is None
+
+
+def test_empty_answer_cache_misses(answer_cache):
+    assert answer_cache._find_cached_answer(_unit(1, 0, 0)) is None
+
+
+def test_answer_cache_evicts_oldest_on_wrap_around(answer_cache):
+    vectors = [_unit(1, 0, 0, 0), _unit(0, 1, 0, 0), _unit(0, 0, 1, 0), _unit(0, 0, 0, 1)]
+    for i, vector in enumerate(vectors):
+        answer_cache._remember_answer(vector, {'answer': i})
+    
+    assert answer_cache._answer_cache_vectors.shape == (3, 4)
+    assert answer_cache._find_cached_answer(vectors[0]) is None
+    assert [answer_cache._find_cached_answer(vector) for vector in vectors[1:]] == [
+        {'answer': 1}, {'answer': 2}, {'answer': 3}
+    ]
+    
+    # Следующая запись вытесняет второй по старшинству ответ
+    answer_cache._remember_answer(vectors[0], {'answer': 'снова'})
+    assert answer_cache._find_cached_answer(vectors[1]) is None
+    assert answer_cache._find_cached_answer(vectors[0]) == {'answer': 'снова'}
+
+
+def test_clear_answer_cache(answer_cache):
+    answer_cache._remember_answer(_unit(1, 0), {'answer': 'старый документ'})
+    
+    answer_cache._clear_answer_cache()
+    
+    assert answer_cache._find_cached_answer(_unit(1, 0)) is None
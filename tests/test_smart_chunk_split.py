@@ -0,0 +1,119 @@
+"""Тесты разбиения текста документа на чанки"""
+
+import random
+
+import pytest
+
+import bot.simple_rag as simple_rag
+from bot.simple_rag import SimpleRAG, _iter_sentences
+
+
+class Doc:
+    """Минимальная замена langchain Document"""
+    
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setattr(simple_rag, 'Document', Doc)
+    return SimpleRAG.__new__(SimpleRAG)
+
+
+def _numbered_text(count, seed=0):
+    """Текст из уникальных предложений разной длины с разными разделителями"""
+    rng = random.Random(seed)
+    words = ['модель', 'градиент', 'выборка', 'признак', 'ошибка', 'обучение']
+    sentences = []
+    for i in range(count):
+        body = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 25)))
+        sentences.append(f"Предложение {i} {body}{rng.choice('.!?')}")
+    return ''.join(sentence + rng.choice([' ', '  ', '\n', ' \n ']) for sentence in sentences)
+
+
+def test_iter_sentences_offsets_point_into_text():
+    text = _numbered_text(200) + ' ' + 'слово ' * 300 + 'x' * 450
+    
+    for start, sentence in _iter_sentences(text, 120):
+        assert text[start:start + len(sentence)] == sentence
+        assert sentence == sentence.strip()
+
+
+def test_oversized_sentences_are_cut_at_whitespace():
+    long_sentence = ' '.join(f"w{i}" for i in range(1000))
+    
+    pieces = [sentence for _, sentence in _iter_sentences(long_sentence, 100)]
+    
+    assert len(pieces) > 1
+    assert all(len(piece) <= 100 for piece in pieces)
+    assert ' '.join(pieces) == long_sentence
+
+
+def test_oversized_word_is_cut_hard():
+    word = 'я' * 250
+    
+    pieces = [sentence for _, sentence in _iter_sentences(word, 100)]
+    
+    assert [len(piece) for piece in pieces] == [100, 100, 50]
+    assert ''.join(pieces) == word
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_chunks_respect_size_and_overlap(rag, seed):
+    chunk_size, overlap = 300, 40
+    pages = [Doc(_numbered_text(60, seed)), Doc(_numbered_text(60, seed + 100))]
+    
+    chunks = rag._smart_chunk_split(pages, chunk_size, overlap)
+    
+    assert len(chunks) > 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Чанк начинается с хвоста предыдущего
+        assert chunk.page_content.startswith(previous.page_content[-overlap:].lstrip())
+    for chunk in chunks:
+        # Перекрытие и пробел могут добавиться к полному чанку
+        assert len(chunk.page_content) <= chunk_size + overlap + 1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_chunk_offsets_match_full_text(rag, seed):
+    pages = [Doc(_numbered_text(80, seed))]
+    full_text = ''.join(page.page_content + '\n' for page in pages)
+    
+    chunks = rag._smart_chunk_split(pages, 250, 30)
+    
+    for chunk in chunks:
+        start, end = chunk.metadata['start'], chunk.metadata['end']
+        assert 0 <= start < end <= len(full_text)
+        # Конец чанка совпадает с концом его последнего предложения в тексте
+        assert full_text[end - 10:end] == chunk.page_content[-10:]
+    
+    # У первого чанка нет перекрытия: границы точные
+    first = chunks[0]
+    original = full_text[first.metadata['start']:first.metadata['end']]
+    assert ' '.join(original.split()) == ' '.join(first.page_content.split())
+    
+    # Границы соседних чанков идут по порядку и перекрываются
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.metadata['start'] <= chunk.metadata['start'] < previous.metadata['end']
+        assert previous.metadata['end'] < chunk.metadata['end']
+
+
+def test_duplicate_chunks_are_dropped(rag):
+    pages = [Doc("Колонтитул страницы. " * 40)]
+    
+    chunks = rag._smart_chunk_split(pages, 100, 20)
+    
+    normalized = [' '.join(chunk.page_content.lower().split()) for chunk in chunks]
+    assert len(normalized) == len(set(normalized))
+    # Без удаления повторов здесь получилось бы 13 одинаковых чанков
+    assert len(chunks) == 1
+
+
+def test_drop_duplicate_chunks_ignores_case_and_spaces(rag):
+    chunks = [Doc("Первый  чанк"), Doc("первый чанк"), Doc("Второй\nчанк"), Doc("ВТОРОЙ чанк ")]
+    
+    unique = rag._drop_duplicate_chunks(chunks)
+    
+    assert unique == [chunks[0], chunks[2]]
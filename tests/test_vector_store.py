@@ -0,0 +1,181 @@
+"""Тесты векторного хранилища, не требующие ChromaDB и модели эмбеддингов"""
+
+import numpy as np
+import pytest
+
+from bot.rag import vector_store
+from bot.rag.vector_store import ONNX_QUANTIZED_EXPORTS, _select_onnx_model_file
+
+
+@pytest.mark.parametrize('machine, flags, expected', [
+    ('aarch64', frozenset(), 'onnx/model_qint8_arm64.onnx'),
+    ('arm64', frozenset({'avx512f'}), 'onnx/model_qint8_arm64.onnx'),
+    ('x86_64', frozenset({'avx2', 'avx512f', 'avx512_vnni'}), 'onnx/model_qint8_avx512_vnni.onnx'),
+    ('x86_64', frozenset({'avx2', 'avx512f'}), 'onnx/model_qint8_avx512.onnx'),
+    ('x86_64', frozenset({'avx2'}), 'onnx/model_quint8_avx2.onnx'),
+    ('AMD64', frozenset(), 'onnx/model_quint8_avx2.onnx'),
+])
+def test_onnx_export_matches_cpu(machine, flags, expected):
+    assert _select_onnx_model_file(machine, flags) == expected
+    assert expected in ONNX_QUANTIZED_EXPORTS
+
+
+def test_onnx_export_for_this_machine_exists():
+    assert vector_store.ONNX_INT8_MODEL_FILE in ONNX_QUANTIZED_EXPORTS
+
+
+class FakeCollection:
+    """Коллекция ChromaDB в памяти, считающая обращения get"""
+    
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.get_calls = 0
+    
+    def get(self, include=None):
+        self.get_calls += 1
+        count = len(self.embeddings)
+        return {
+            'ids': [f"chunk_{i}" for i in range(count)],
+            'embeddings': self.embeddings,
+            'documents': [f"текст {i}" for i in range(count)],
+            'metadatas': [{'chunk_index': i} for i in range(count)]
+        }
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(vector_store, 'np', np)
+    monkeypatch.setattr(vector_store, 'simsimd', None)
+    monkeypatch.setattr(vector_store, 'USER_INDEX_CACHE_SIZE', 2)
+    
+    store = vector_store.VectorStore.__new__(vector_store.VectorStore)
+    store._user_index = vector_store.OrderedDict()
+    store._collections = {
+        user_id: FakeCollection(np.eye(3, dtype=np.float32).tolist())
+        for user_id in (1, 2, 3)
+    }
+    return store
+
+
+def test_user_index_is_bounded_lru(store):
+    store._get_user_index(1)
+    store._get_user_index(2)
+    store._get_user_index(1)
+    store._get_user_index(3)
+    
+    assert list(store._user_index) == [1, 3]
+    
+    # Вытесненный индекс загружается из коллекции заново
+    store._get_user_index(2)
+    assert store._collections[2].get_calls == 2
+    assert store._collections[1].get_calls == 1
+
+
+def test_int8_index_ranks_nearest_chunk_first(store):
+    index = store._get_user_index(1)
+    query = store._quantize(np.asarray([0.1, 0.99, 0.0], dtype=np.float32))
+    
+    distances = store._int8_cosine_distances(query, index)
+    
+    assert int(np.argmin(distances)) == 1
+    assert distances[1] == pytest.approx(1 - 0.99 / np.hypot(0.1, 0.99), abs=0.01)
+
+
+class FakeStoredCollection:
+    """Коллекция ChromaDB в памяти с постраничным get и upsert"""
+    
+    def __init__(self):
+        self.rows = {}
+    
+    def count(self):
+        return len(self.rows)
+    
+    def get(self, include=None, limit=None, offset=0):
+        ids = list(self.rows)[offset:None if limit is None else offset + limit]
+        return {
+            'ids': ids,
+            'embeddings': [self.rows[i][0] for i in ids],
+            'documents': [self.rows[i][1] for i in ids],
+            'metadatas': [self.rows[i][2] for i in ids]
+        }
+    
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for row in zip(ids, embeddings, documents, metadatas):
+            self.rows[row[0]] = (list(row[1]), row[2], row[3])
+
+
+class FakeChromaClient:
+    """Клиент ChromaDB в памяти; отсутствующая коллекция - ValueError, как в старых версиях"""
+    
+    def __init__(self):
+        self.collections = {}
+    
+    def get_collection(self, name):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+    
+    def get_or_create_collection(self, name):
+        return self.collections.setdefault(name, FakeStoredCollection())
+    
+    def delete_collection(self, name):
+        del self.collections[name]
+
+
+@pytest.fixture
+def chroma_store(monkeypatch):
+    monkeypatch.setattr(vector_store, 'np', np)
+    monkeypatch.setattr(vector_store, 'MIGRATION_BATCH_SIZE', 2)
+    
+    store = vector_store.VectorStore.__new__(vector_store.VectorStore)
+    store.chroma_client = FakeChromaClient()
+    store._collections = {}
+    store._user_index = vector_store.OrderedDict()
+    store._doc_index = {}
+    return store
+
+
+def test_legacy_collection_is_migrated_per_user(chroma_store):
+    legacy = chroma_store.chroma_client.get_or_create_collection(vector_store.LEGACY_COLLECTION_NAME)
+    legacy.upsert(
+        ids=['1_10_0', '2_20_0', '1_10_1', 'orphan'],
+        embeddings=[[3.0, 4.0], [0.0, 2.0], [1.0, 0.0], [1.0, 1.0]],
+        documents=['a', 'b', 'c', 'd'],
+        metadatas=[{'user_id': 1}, {'user_id': 2}, {'user_id': 1}, {}]
+    )
+    
+    chroma_store._migrate_legacy_collection()
+    
+    collections = chroma_store.chroma_client.collections
+    assert set(collections) == {'user_1', 'user_2'}
+    assert list(collections['user_1'].rows) == ['1_10_0', '1_10_1']
+    assert list(collections['user_2'].rows) == ['2_20_0']
+    
+    # Векторы нормализованы, тексты и метаданные перенесены без изменений
+    expected = {'1_10_0': ([0.6, 0.8], 'a'), '1_10_1': ([1.0, 0.0], 'c'), '2_20_0': ([0.0, 1.0], 'b')}
+    for name in ('user_1', 'user_2'):
+        for chunk_id, (embedding, document, metadata) in collections[name].rows.items():
+            assert embedding == pytest.approx(expected[chunk_id][0])
+            assert document == expected[chunk_id][1]
+            assert metadata == {'user_id': int(name[5:])}
+
+
+def test_migration_without_legacy_collection_is_noop(chroma_store):
+    chroma_store._migrate_legacy_collection()
+    
+    assert chroma_store.chroma_client.collections == {}
+
+
+def test_delete_user_documents_does_not_create_collection(chroma_store):
+    chroma_store.delete_user_documents(7)
+    
+    assert chroma_store.chroma_client.collections == {}
+
+
+def test_delete_user_documents_drops_collection(chroma_store):
+    chroma_store._get_collection(7).upsert(ids=['7_1_0'], embeddings=[[1.0]], documents=['x'], metadatas=[{}])
+    
+    chroma_store.delete_user_documents(7)
+    
+    assert chroma_store.chroma_client.collections == {}
+    assert 7 not in chroma_store._collections